@@ -4,9 +4,11 @@ Janus — REST API routes (all-in-one router).
 from __future__ import annotations
 
 import logging
+from typing import Any, List
 
+import orjson
 from fastapi import APIRouter, File, HTTPException, UploadFile
-from fastapi.responses import Response, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 from core.event_bus import event_bus
 from core.inventory_service import list_drives, list_images, list_physical_ports, list_ports
@@ -14,16 +16,24 @@ from core.job_manager import job_manager
 from core.layout_service import (
     export_layout_bytes,
     get_layout,
+    get_layout_columns,
     import_layout,
     save_layout,
 )
-from core.models import BatchStartRequest, LayoutConfig
+from core.models import BatchStartRequest, JobInfo, LayoutConfig, dump_driveinfo
 
 log = logging.getLogger("janus.api")
 
 router = APIRouter(prefix="/api")
 
 
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
 # ── Layout ───────────────────────────────────────────────────────────────────
 
 @router.get("/layout", summary="Get current grid layout")
@@ -31,6 +41,11 @@ def api_get_layout():
     return get_layout().model_dump()
 
 
+@router.get("/layout/columns", summary="Get grid layout with cells as columns")
+def api_get_layout_columns():
+    return FastJSONResponse(get_layout_columns())
+
+
 @router.put("/layout", summary="Save grid layout")
 def api_put_layout(layout: LayoutConfig):
     save_layout(layout)
@@ -58,6 +73,8 @@ def api_export_layout():
 
 
 # ── Inventory ────────────────────────────────────────────────────────────────
+# Polled routes return a response object directly: their payloads are plain
+# dicts already, so FastAPI's jsonable_encoder pass is skipped.
 
 @router.get("/ports", summary="List available USB ports (flat)")
 def api_list_ports():
@@ -66,12 +83,12 @@ def api_list_ports():
 
 @router.get("/ports/physical", summary="List physical USB ports with current device info")
 def api_list_physical_ports():
-    return list_physical_ports()
+    return FastJSONResponse(list_physical_ports())
 
 
 @router.get("/drives", summary="List connected drives")
 def api_list_drives(removable: int = 0):
-    return [d.model_dump() for d in list_drives(removable_only=bool(removable))]
+    return FastJSONResponse([dump_driveinfo(d) for d in list_drives(removable_only=bool(removable))])
 
 
 @router.get("/images", summary="List available images")
@@ -80,11 +97,17 @@ def api_list_images():
 
 
 # ── Jobs & Batch ─────────────────────────────────────────────────────────────
+# Jobs are returned as JobRecord.to_dict(); JobInfo only documents the shape
+# (a response_model would re-validate every job on the way out).
 
-@router.post("/batch/start", summary="Start batch flash")
+_JOB = {200: {"model": JobInfo}}
+_JOB_LIST = {200: {"model": List[JobInfo]}}
+
+
+@router.post("/batch/start", summary="Start batch flash", responses=_JOB_LIST)
 async def api_batch_start(req: BatchStartRequest):
     jobs = await job_manager.start_batch(req)
-    return [j.model_dump() for j in jobs]
+    return [j.to_dict() for j in jobs]
 
 
 @router.post("/batch/cancel", summary="Cancel all active jobs")
@@ -93,23 +116,23 @@ async def api_batch_cancel():
     return {"ok": True}
 
 
-@router.post("/batch/retry", summary="Retry all failed jobs")
+@router.post("/batch/retry", summary="Retry all failed jobs", responses=_JOB_LIST)
 async def api_batch_retry():
     jobs = await job_manager.retry_all_failed()
-    return [j.model_dump() for j in jobs]
+    return [j.to_dict() for j in jobs]
 
 
-@router.get("/jobs", summary="List all jobs")
+@router.get("/jobs", summary="List all jobs", responses=_JOB_LIST)
 def api_list_jobs():
-    return [j.model_dump() for j in job_manager.list_jobs()]
+    return FastJSONResponse([j.to_dict() for j in job_manager.list_jobs()])
 
 
-@router.get("/jobs/{job_id}", summary="Get job details")
+@router.get("/jobs/{job_id}", summary="Get job details", responses=_JOB)
 def api_get_job(job_id: str):
     job = job_manager.get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    return job.model_dump()
+    return FastJSONResponse(job.to_dict())
 
 
 @router.post("/jobs/{job_id}/cancel", summary="Cancel a job")
@@ -120,12 +143,12 @@ async def api_cancel_job(job_id: str):
     return {"ok": True}
 
 
-@router.post("/jobs/{job_id}/retry", summary="Retry a job")
+@router.post("/jobs/{job_id}/retry", summary="Retry a job", responses=_JOB)
 async def api_retry_job(job_id: str):
     job = await job_manager.retry_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found or not in retryable state")
-    return job.model_dump()
+    return job.to_dict()
 
 
 @router.post("/cells/{cell_id}/eject", summary="Eject device in cell")
@@ -140,23 +163,27 @@ import asyncio as _asyncio
 
 # ── SSE Events ───────────────────────────────────────────────────────────────
 
+_HEARTBEAT = b": heartbeat\n\n"
+
+
 @router.get("/events", summary="SSE event stream")
 async def api_events():
     async def event_generator():
-        subscriber = event_bus.subscribe()
-        # Use a queue approach: wait for event or send heartbeat every 15s
-        while True:
-            try:
-                # Wait up to 15 seconds for next event
-                event_type, payload = await _asyncio.wait_for(
-                    subscriber.__anext__(), timeout=15.0
-                )
-                yield f"event: {event_type}\ndata: {payload}\n\n"
-            except _asyncio.TimeoutError:
-                # Send SSE comment as keepalive
-                yield ": heartbeat\n\n"
-            except StopAsyncIteration:
-                break
+        sub = event_bus.add_subscriber()
+        try:
+            while True:
+                if not sub.has_pending():
+                    try:
+                        # Wait up to 15 seconds for next event
+                        await _asyncio.wait_for(sub.wait(), timeout=15.0)
+                    except _asyncio.TimeoutError:
+                        # Send SSE comment as keepalive
+                        yield _HEARTBEAT
+                        continue
+                # Everything that piled up goes out in one write
+                yield b"".join(sub.drain())
+        finally:
+            event_bus.unsubscribe(sub)
 
     return StreamingResponse(
         event_generator(),
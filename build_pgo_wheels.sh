@@ -0,0 +1,80 @@
+#!/usr/bin/env bash
+# Rebuild pydantic-core and orjson with PGO + fat LTO for the machine Janus runs on.
+#
+#   sudo VENV=/opt/janus/venv ./build_pgo_wheels.sh
+#
+# Needs: rustup (with llvm-tools-preview), a C toolchain, network for the sdists.
+# The versions already installed in $VENV are rebuilt; wheels end up in $OUT
+# and are installed into $VENV.
+set -euo pipefail
+
+VENV=${VENV:-/opt/janus/venv}
+OUT=${OUT:-$(pwd)/wheels}
+PY="$VENV/bin/python"
+HERE=$(cd "$(dirname "$0")" && pwd)
+WORK=$(mktemp -d)
+trap 'rm -rf "$WORK"' EXIT
+
+rustup component add llvm-tools-preview
+PROFDATA=$(ls "$(rustc --print sysroot)"/lib/rustlib/*/bin/llvm-profdata | head -n1)
+"$PY" -m pip install -q maturin
+mkdir -p "$OUT"
+
+PACKAGES="pydantic-core orjson"
+
+version() {
+    "$PY" -c "import importlib.metadata as m, sys; print(m.version(sys.argv[1]))" "$1"
+}
+
+build() {  # build <package> <wheel dir>, RUSTFLAGS from the caller
+    local src
+    src=$(find "$WORK/src-$1" -mindepth 1 -maxdepth 1 -type d | head -n1)
+    (cd "$src" && "$VENV/bin/maturin" build --release -i "$PY" --out "$2")
+    "$PY" -m pip install -q --force-reinstall --no-deps "$2"/*.whl
+}
+
+export CARGO_PROFILE_RELEASE_LTO=fat
+export CARGO_PROFILE_RELEASE_CODEGEN_UNITS=1
+
+# ── 1. Instrumented builds ───────────────────────────────────────────────────
+for pkg in $PACKAGES; do
+    ver=$(version "$pkg")
+    mkdir -p "$WORK/src-$pkg"
+    "$PY" -m pip download -q --no-deps --no-binary :all: "$pkg==$ver" -d "$WORK/sdist-$pkg"
+    tar -xzf "$WORK/sdist-$pkg"/*.tar.gz -C "$WORK/src-$pkg"
+    RUSTFLAGS="-Cprofile-generate=$WORK/prof-$pkg" build "$pkg" "$WORK/instr-$pkg"
+done
+
+# ── 2. Training run: what Janus does on its hot paths ───────────────────────
+(cd "$HERE" && "$PY" - <<'EOF'
+import orjson
+
+from core.layout_service import _default_layout
+from core.models import (
+    BatchInfo, BatchStartRequest, DriveInfo, JobInfo, JobRecord, LayoutConfig, dump_driveinfo,
+)
+
+layout = _default_layout()
+for i in range(20000):
+    req = BatchStartRequest.model_validate(
+        {"image_name": "x.img", "cell_ids": ["A1", "A2"], "options": {"verify": True}})
+    BatchInfo(batch_id=str(i), image_name=req.image_name, options=req.options,
+              cell_ids=req.cell_ids).model_dump()
+    job = JobRecord(job_id=str(i), cell_id="A1", device_path="/dev/sdb", image_name="x.img")
+    job.log_tail.append(f"line {i}")
+    JobInfo.model_validate(job.to_dict()).model_dump()
+    orjson.dumps({"updates": [job.to_dict(), {"job_id": job.job_id, "patch": job.progress_dump()}]})
+    layout = LayoutConfig.model_validate_json(orjson.dumps(layout.model_dump(mode="json")))
+    dump_driveinfo(DriveInfo(device_path="/dev/sdb", size_bytes=i, mountpoints=["/media/x"]))
+EOF
+)
+
+# ── 3. Optimized builds ──────────────────────────────────────────────────────
+for pkg in $PACKAGES; do
+    "$PROFDATA" merge -o "$WORK/$pkg.profdata" "$WORK/prof-$pkg"
+    RUSTFLAGS="-Cprofile-use=$WORK/$pkg.profdata -Cllvm-args=-pgo-warn-mismatch=false" \
+        build "$pkg" "$WORK/pgo-$pkg"
+    cp "$WORK/pgo-$pkg"/*.whl "$OUT/"
+done
+
+echo "PGO wheels installed into $VENV and copied to $OUT"
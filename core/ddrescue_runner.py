@@ -1,7 +1,10 @@
+import asyncio
 import re
-import subprocess
 import shlex
-from typing import Callable
+import time
+from typing import Callable, Sequence
+
+from core.flash_runner import PROGRESS_INTERVAL, device_size
 
 # Паттерны для парсинга вывода ddrescue (stderr)
 # Пример строки ddrescue:
@@ -9,89 +12,80 @@ from typing import Callable
 #   ipos:    1234 MB,   errors:       0,    average rate:   40 MB/s
 #   opos:    1234 MB,   time since last successful read:          0 s
 #   Finished
-RE_RESCUED = re.compile(r"rescued:\s+([\d.]+ \w+)", re.IGNORECASE)
-RE_ERRSIZE = re.compile(r"errsize:\s+([\d.]+ \w+)", re.IGNORECASE)
-RE_ERRORS  = re.compile(r"errors:\s+(\d+)", re.IGNORECASE)
-RE_RATE    = re.compile(r"current rate:\s+([\d.]+ \w+/s)", re.IGNORECASE)
-RE_ELAPSED = re.compile(r"(\d+:\d{2}:\d{2})")
-
-# Паттерн прогресса (ddrescue выводит размер в процентах через --log-rates или парсим rescued/total)
-# Для определения % нужно знать общий размер устройства — получим его через lsblk/blockdev
-RE_IPOS = re.compile(r"ipos:\s+([\d.]+ \w+)", re.IGNORECASE)
-
-
-def parse_ddrescue_line(line: str) -> dict:
-    """Парсит одну строку вывода ddrescue и возвращает словарь с найденными полями."""
+# Все поля разбираются одним проходом по строке: одна альтернатива на поле,
+# имя группы совпадает с ключом в результате parse_ddrescue_line().
+# Паттерны байтовые: вывод ddrescue — ASCII, строки не декодируются целиком.
+RE_ALL = re.compile(
+    rb"rescued:\s+(?P<rescued>[\d.]+ \w+)"
+    rb"|errors:\s+(?P<errors>\d+)"
+    rb"|current rate:\s+(?P<rate>[\d.]+ \w+/s)"
+    rb"|(?P<elapsed>\d+:\d{2}:\d{2})",
+    re.IGNORECASE,
+)
+
+
+def parse_ddrescue_line(line: bytes) -> dict:
+    """
+    Парсит одну строку вывода ddrescue (bytes) и возвращает словарь
+    с найденными полями.  Декодируются только сами значения полей.
+    """
     result = {}
+    # Каждое поле содержит ':' — строки без него не трогают движок регулярок
+    if b":" not in line:
+        return result
 
-    m = RE_RESCUED.search(line)
-    if m:
-        result["rescued"] = m.group(1)
-
-    m = RE_ERRORS.search(line)
-    if m:
-        result["errors"] = m.group(1)
-
-    m = RE_RATE.search(line)
-    if m:
-        result["rate"] = m.group(1)
-
-    m = RE_ELAPSED.search(line)
-    if m:
-        result["elapsed"] = m.group(1)
+    for m in RE_ALL.finditer(line):
+        key = m.lastgroup
+        if key not in result:
+            result[key] = m.group(key).decode("ascii")
 
     return result
 
 
 def get_device_size_bytes(device: str) -> int:
     """Возвращает размер устройства/файла в байтах. 0 — если не удалось определить."""
-    try:
-        result = subprocess.run(
-            ["blockdev", "--getsize64", device],
-            capture_output=True, text=True, timeout=5
-        )
-        if result.returncode == 0:
-            return int(result.stdout.strip())
-    except Exception:
-        pass
-    return 0
+    # Кэшируется в flash_runner: blockdev не запускается повторно для того же пути
+    return device_size(device)
+
+
+_SIZE_UNITS = {
+    "B": 1,
+    "KB": 1 << 10, "KiB": 1 << 10,
+    "MB": 1 << 20, "MiB": 1 << 20,
+    "GB": 1 << 30, "GiB": 1 << 30,
+    "TB": 1 << 40, "TiB": 1 << 40,
+}
+_SIZE_RE = re.compile(r"\s*(\d+(?:\.\d+)?)\s+(\w+)\s*")
 
 
 def parse_size_to_bytes(size_str: str) -> int:
     """Преобразует строку вида '1.23 GB' в байты."""
-    units = {
-        "B": 1,
-        "KB": 1024, "KiB": 1024,
-        "MB": 1024**2, "MiB": 1024**2,
-        "GB": 1024**3, "GiB": 1024**3,
-        "TB": 1024**4, "TiB": 1024**4,
-    }
-    parts = size_str.strip().split()
-    if len(parts) == 2:
-        try:
-            value = float(parts[0])
-            unit = parts[1]
-            return int(value * units.get(unit, 1))
-        except (ValueError, KeyError):
-            pass
-    return 0
-
-
-def run_ddrescue(
+    m = _SIZE_RE.fullmatch(size_str)
+    if not m:
+        return 0
+    return int(float(m.group(1)) * _SIZE_UNITS.get(m.group(2), 1))
+
+
+async def run_ddrescue(
     job_id: str,
     source: str,
     destination: str,
     log_file: str | None,
-    extra_args: str,
+    extra_args: str | Sequence[str],
     on_update: Callable[[str, dict], None],
     on_finish: Callable[[str, int, str | None], None],
-) -> subprocess.Popen:
+) -> asyncio.subprocess.Process:
     """
-    Запускает ddrescue в subprocess.Popen и возвращает объект процесса.
-    Эта функция предназначена для вызова в отдельном потоке.
+    Запускает ddrescue через asyncio.create_subprocess_exec и возвращает
+    объект процесса после его завершения.  Вывод читается в event loop —
+    отдельный поток на всё время работы ddrescue не нужен.
 
-    Колбэки:
-      on_update(job_id, fields)   — вызывается при каждом обновлении прогресса
+    extra_args — готовый список аргументов (используется как есть) или
+    строка, которая разбирается через shlex.
+
+    Колбэки (вызываются в event loop, не должны блокировать):
+      on_update(job_id, fields)   — обновление прогресса, не чаще раза
+                                    в PROGRESS_INTERVAL (последнее не теряется)
       on_finish(job_id, returncode, error_message) — вызывается по завершении
     """
     cmd = ["ddrescue", "--force", "-v"]
@@ -101,25 +95,32 @@ def run_ddrescue(
     else:
         cmd += [source, destination]
 
-    if extra_args:
+    if isinstance(extra_args, str):
         cmd += shlex.split(extra_args)
+    else:
+        cmd += list(extra_args)
 
-    total_bytes = get_device_size_bytes(source)
+    total_bytes = await asyncio.to_thread(get_device_size_bytes, source)
 
+    proc = None
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
         )
 
         on_update(job_id, {"pid": proc.pid})
 
-        for line in proc.stdout:
-            line = line.rstrip()
-            fields = parse_ddrescue_line(line)
+        # Поля, накопленные между отправками: ddrescue печатает прогресс
+        # чаще, чем его имеет смысл пересылать в браузер
+        pending: dict = {}
+        last_sent = 0.0
+        while True:
+            raw = await proc.stdout.readline()
+            if not raw:
+                break
+            fields = parse_ddrescue_line(raw)
 
             # Вычисляем % прогресса по объёму rescued
             if "rescued" in fields and total_bytes > 0:
@@ -127,17 +128,31 @@ def run_ddrescue(
                 fields["progress_pct"] = round(rescued_bytes / total_bytes * 100, 1)
 
             if fields:
-                on_update(job_id, fields)
+                pending.update(fields)
+                now = time.monotonic()
+                if now - last_sent >= PROGRESS_INTERVAL:
+                    last_sent = now
+                    on_update(job_id, pending)
+                    pending = {}
+
+        if pending:
+            on_update(job_id, pending)
 
-        proc.wait()
+        await proc.wait()
         error_msg = None if proc.returncode == 0 else f"ddrescue завершился с кодом {proc.returncode}"
         on_finish(job_id, proc.returncode, error_msg)
         return proc
 
+    except asyncio.CancelledError:
+        # Задачу отменили: ddrescue не должен продолжать писать на устройство
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        on_finish(job_id, -1, "Отменено")
+        raise
     except FileNotFoundError:
         on_finish(job_id, -1, "ddrescue не найден. Установите пакет gddrescue.")
         raise
     except Exception as e:
         on_finish(job_id, -1, str(e))
         raise
-
@@ -1,47 +1,94 @@
 """
-Janus — простой pub/sub event bus на asyncio.Queue.
+Janus — простой pub/sub event bus на asyncio (с коалесценцией частых событий).
 """
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
-from typing import Any, AsyncGenerator, Dict
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional
+
+import orjson
 
 log = logging.getLogger("janus.events")
 
+MAX_PENDING = 256  # unsent non-coalesced frames before a subscriber is dropped
+
+
+def _dumps(data: Any) -> bytes:
+    return orjson.dumps(data, default=str)
+
+
+class Subscriber:
+    """
+    Pending frames of one SSE client.  Keyed frames keep only the latest
+    value per key (a newer progress update replaces an unsent older one);
+    frames without a key are queued in order.
+    """
+
+    def __init__(self):
+        self._latest: Dict[Hashable, bytes] = {}
+        self._fifo: Deque[bytes] = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, frame: bytes, key: Optional[Hashable] = None) -> bool:
+        """Queue a frame; False if the subscriber has fallen too far behind."""
+        if key is None:
+            if len(self._fifo) >= MAX_PENDING:
+                return False
+            self._fifo.append(frame)
+        else:
+            # Re-insert so drain order follows the most recent publish
+            self._latest.pop(key, None)
+            self._latest[key] = frame
+        self._ready.set()
+        return True
+
+    def has_pending(self) -> bool:
+        return self._ready.is_set()
+
+    async def wait(self):
+        await self._ready.wait()
+
+    def drain(self) -> List[bytes]:
+        frames = list(self._fifo)
+        frames.extend(self._latest.values())
+        self._fifo.clear()
+        self._latest.clear()
+        self._ready.clear()
+        return frames
+
 
 class EventBus:
     """Broadcast events to all SSE subscribers."""
 
     def __init__(self):
-        self._subscribers: Dict[int, asyncio.Queue] = {}
-        self._counter = 0
+        self._subscribers: Dict[int, Subscriber] = {}
 
-    async def publish(self, event_type: str, data: Any):
-        """Send event to every active subscriber."""
-        payload = json.dumps(data, default=str)
+    async def publish(self, event_type: str, data: Any, key: Optional[Hashable] = None):
+        """
+        Send event to every active subscriber.  Events published with a key
+        (e.g. a job id) coalesce: a subscriber that has not yet sent the
+        previous event for the same (event_type, key) only gets the newest.
+        """
+        # Encode the SSE frame once; every subscriber gets the same bytes
+        frame = b"event: " + event_type.encode() + b"\ndata: " + _dumps(data) + b"\n\n"
+        slot = None if key is None else (event_type, key)
         dead = []
-        for sid, q in self._subscribers.items():
-            try:
-                q.put_nowait((event_type, payload))
-            except asyncio.QueueFull:
+        for sid, sub in self._subscribers.items():
+            if not sub.push(frame, slot):
                 dead.append(sid)
         for sid in dead:
             self._subscribers.pop(sid, None)
 
-    async def subscribe(self) -> AsyncGenerator[tuple[str, str], None]:
-        """Yields (event_type, json_data) tuples."""
-        self._counter += 1
-        sid = self._counter
-        q: asyncio.Queue = asyncio.Queue(maxsize=256)
-        self._subscribers[sid] = q
-        try:
-            while True:
-                event_type, payload = await q.get()
-                yield event_type, payload
-        finally:
-            self._subscribers.pop(sid, None)
+    def add_subscriber(self) -> Subscriber:
+        """Register a subscriber; its frames are collected with drain()."""
+        sub = Subscriber()
+        self._subscribers[id(sub)] = sub
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self._subscribers.pop(id(sub), None)
 
     def subscriber_count(self) -> int:
         return len(self._subscribers)
@@ -49,4 +96,3 @@ class EventBus:
 
 # Global singleton
 event_bus = EventBus()
-
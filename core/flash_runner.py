@@ -1,21 +1,40 @@
 """
-Janus — Flash runner: dd-based writing pipeline with optional verify / expand / resize.
+Janus — Flash runner: image writing pipeline with optional verify / expand / resize.
 """
 from __future__ import annotations
 
+import errno
+import fcntl
+import functools
 import hashlib
 import logging
+import mmap
 import os
 import re
+import select
 import subprocess
+import tempfile
 import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Callable, Optional
 
+from core.lsblk_cache import get_topology
+
+try:
+    import blake3
+except ImportError:  # optional, faster verify
+    blake3 = None
+
 log = logging.getLogger("janus.flash")
 
 UpdateCb = Callable[[dict], None]  # on_update(fields)
 
+PROGRESS_INTERVAL = 0.1  # s; browsers gain nothing from more than ~10 updates/s
+
+_RE_PART_NUM = re.compile(r"(\d+)$")  # sdb2 → 2, mmcblk0p2 → 2
+
 
 def _human_speed(bps: float) -> str:
     if bps < 1024:
@@ -35,177 +54,408 @@ def _human_eta(secs: float) -> str:
     return f"{h}:{m:02d}:{s:02d}" if h else f"{m}:{s:02d}"
 
 
+def _throttle(cb: UpdateCb, min_interval: float = PROGRESS_INTERVAL) -> UpdateCb:
+    """
+    Drop updates arriving within min_interval of the last one passed on.
+    The first update and any with progress >= 1.0 always go through.
+    """
+    last = [0.0]
+
+    def wrapped(fields: dict):
+        now = time.monotonic()
+        if fields.get("progress", 0) >= 1.0 or now - last[0] >= min_interval:
+            last[0] = now
+            cb(fields)
+    return wrapped
+
+
+class KillSwitch:
+    """
+    Cancellation flag with the threading.Event interface, backed by a pipe
+    so a blocked reader can select() on it next to its data source.
+    The pipe is closed once the last reference is dropped.
+    """
+
+    def __init__(self):
+        self._r, self._w = os.pipe()
+        self._set = False
+        self._lock = threading.Lock()
+
+    def set(self):
+        with self._lock:
+            # Flag first: whoever wakes on the byte must already see is_set()
+            was_set, self._set = self._set, True
+            if not was_set and self._w >= 0:
+                os.write(self._w, b"x")
+
+    def is_set(self) -> bool:
+        return self._set
+
+    def fileno(self) -> int:
+        return self._r
+
+    def close(self):
+        with self._lock:
+            if self._w >= 0:
+                os.close(self._r)
+                os.close(self._w)
+                self._r = self._w = -1
+
+    __del__ = close
+
+
 def _image_size(image_path: str) -> int:
-    """Return uncompressed image size (or file size for raw .img)."""
+    """Return the image file size (compressed size for .xz/.gz/...)."""
     return os.path.getsize(image_path)
 
 
-def _device_size(device: str) -> int:
+@functools.lru_cache(maxsize=64)
+def _blockdev_size(device: str) -> int:
+    out = subprocess.check_output(
+        ["blockdev", "--getsize64", device],
+        text=True, stderr=subprocess.DEVNULL, timeout=5,
+    ).strip()
+    return int(out)
+
+
+def device_size(device: str) -> int:
+    """
+    Size of a block device in bytes (0 if unknown).  Cached per device path;
+    failures are not cached.  Call clear_device_size_cache() when the medium
+    behind a path may have changed (eject / hotplug).
+    """
     try:
-        out = subprocess.check_output(
-            ["blockdev", "--getsize64", device], text=True, timeout=5
-        ).strip()
-        return int(out)
+        return _blockdev_size(device)
     except Exception:
         return 0
 
 
+def clear_device_size_cache():
+    _blockdev_size.cache_clear()
+
+
 # ── Write stage ──────────────────────────────────────────────────────────────
 
-def write_image(image_path: str, device: str, on_update: UpdateCb,
-                log_lines: list[str],
-                kill_event: Optional[threading.Event] = None) -> bool:
+# Streaming decompressors; the compressed image is fed on stdin
+DECOMPRESSORS = {
+    ".xz": ["xzcat"],
+    ".gz": ["gunzip", "-c"],
+    ".bz2": ["bzcat"],
+    ".zst": ["zstdcat"],
+}
+
+_COPY_CHUNK = 8 * 1024 * 1024
+_O_DIRECT = getattr(os, "O_DIRECT", 0)
+_ERR_TAIL = 4096  # bytes of decompressor stderr kept for the error line
+
+
+def _decompressor_for(image_path: str) -> Optional[list[str]]:
+    for ext, argv in DECOMPRESSORS.items():
+        if image_path.endswith(ext):
+            return argv
+    return None
+
+
+def _open_device(device: str) -> int:
+    """Open device for writing, bypassing the page cache where supported."""
+    flags = os.O_WRONLY | os.O_SYNC
+    if _O_DIRECT:
+        try:
+            return os.open(device, flags | _O_DIRECT)
+        except OSError as exc:
+            if exc.errno != errno.EINVAL:
+                raise
+    return os.open(device, flags)
+
+
+def _clear_o_direct(fd: int) -> bool:
+    """Switch fd to buffered writes; False if it was not O_DIRECT."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    if not _O_DIRECT or not flags & _O_DIRECT:
+        return False
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~_O_DIRECT)
+    return True
+
+
+def _read_full(reader, mv: memoryview, kill_event: Optional[KillSwitch] = None) -> Optional[int]:
     """
-    Write image to device using dd.  Parses dd's status=progress output.
-    Returns True on success.  Kills dd immediately if kill_event is set.
+    Fill mv from reader (pipes return short reads); returns bytes read.
+    With kill_event, waits on the pipe and the switch together and returns
+    None once cancellation is requested, so a cut-off read never looks
+    like EOF.
     """
-    img_size = _image_size(image_path)
-    bs = "4M"
-
-    # Determine if we need decompression
-    if image_path.endswith(".xz"):
-        cmd = f"xzcat '{image_path}' | dd of='{device}' bs={bs} conv=fsync status=progress"
-    elif image_path.endswith(".gz"):
-        cmd = f"gunzip -c '{image_path}' | dd of='{device}' bs={bs} conv=fsync status=progress"
-    elif image_path.endswith(".bz2"):
-        cmd = f"bzcat '{image_path}' | dd of='{device}' bs={bs} conv=fsync status=progress"
-    elif image_path.endswith(".zst"):
-        cmd = f"zstdcat '{image_path}' | dd of='{device}' bs={bs} conv=fsync status=progress"
-    else:
-        cmd = f"dd if='{image_path}' of='{device}' bs={bs} conv=fsync status=progress"
-        # For raw images we know the exact size
-        img_size = os.path.getsize(image_path)
+    got = 0
+    while got < len(mv):
+        if kill_event is not None:
+            ready, _, _ = select.select([reader, kill_event], [], [])
+            if kill_event in ready:
+                return None
+        n = reader.readinto(mv[got:])
+        if not n:
+            break
+        got += n
+    return got
+
+
+def _write_all(fd: int, mv: memoryview):
+    while mv:
+        try:
+            n = os.write(fd, mv)
+        except OSError as exc:
+            # O_DIRECT rejects unaligned lengths (the image tail) → go buffered
+            if exc.errno != errno.EINVAL or not _clear_o_direct(fd):
+                raise
+            continue
+        mv = mv[n:]
 
-    log.info("write cmd: %s", cmd)
-    log_lines.append(f"$ {cmd}")
 
-    proc = subprocess.Popen(
-        cmd, shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
+def _write_chunk(fd: int, buf: mmap.mmap, n: int):
+    with memoryview(buf) as mv:
+        try:
+            _write_all(fd, mv[:n])
+        except OSError as exc:
+            # The traceback's frames hold slices of buf, which would keep
+            # it from being closed; the message is all the caller logs
+            raise exc.with_traceback(None)
 
-    # dd writes progress to stderr
-    start = time.time()
-    buf = ""
-    RE_BYTES = re.compile(r"(\d[\d\s]*)\s+bytes?\b.*copied", re.IGNORECASE)
 
-    cancelled = False
-    while True:
-        # Check kill flag before each read
-        if kill_event and kill_event.is_set():
-            log_lines.append("CANCELLED: killing dd process")
-            try:
-                proc.kill()
-            except Exception:
-                pass
-            cancelled = True
-            break
+def write_image(image_path: str, device: str, on_update: UpdateCb,
+                log_lines: deque[str],
+                kill_event: Optional[KillSwitch] = None) -> bool:
+    """
+    Copy image to device in-process, piping through a decompressor for
+    compressed images.  Two buffers alternate so the next chunk is read
+    while the previous one is written by a helper thread.  Progress is the
+    share of the image file consumed, so it is accurate for compressed
+    images too.
+    Returns True on success.  Stops between chunks if kill_event is set.
+    """
+    on_update = _throttle(on_update)
+    dec_argv = _decompressor_for(image_path)
 
-        # Non-blocking read with a short poll so we can check kill_event
-        import select
-        rlist, _, _ = select.select([proc.stderr], [], [], 0.2)
-        if not rlist:
-            # No data yet — check if process finished
-            if proc.poll() is not None:
+    if dec_argv:
+        log_lines.append(f"$ {' '.join(dec_argv)} < {image_path} > {device}")
+    else:
+        log_lines.append(f"copy {image_path} → {device}")
+    log.info("write %s → %s (decompressor: %s)", image_path, device, dec_argv)
+
+    src = None
+    dec: Optional[subprocess.Popen] = None
+    dec_err = b""
+    err_file = None
+    bufs: list[mmap.mmap] = []
+    pending: Optional[Future] = None  # write of the previous chunk
+    out_fd = -1
+    cancelled = False
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="janus-write")
+    try:
+        img_size = _image_size(image_path)
+        src = open(image_path, "rb", buffering=0)
+        if dec_argv:
+            # The decompressor shares src's file offset, so seeking src to
+            # its current position tells how much of the image it has read.
+            # stderr goes to a file: a pipe nobody reads until the end would
+            # stall a chatty decompressor, and the copy loop with it.
+            err_file = tempfile.TemporaryFile()
+            dec = subprocess.Popen(
+                dec_argv, stdin=src,
+                stdout=subprocess.PIPE, stderr=err_file, bufsize=0,
+            )
+        out_fd = _open_device(device)
+
+        # mmap memory is page-aligned, as O_DIRECT requires
+        bufs = [mmap.mmap(-1, _COPY_CHUNK) for _ in range(2)]
+        idx = 0
+        reader = dec.stdout if dec else src
+        start = time.time()
+        written = 0
+        # The display strings change far more rarely than the numbers:
+        # reformat only when a value leaves its bucket
+        speed_bucket = eta_bucket = -1
+        speed_human = eta_human = ""
+        while True:
+            # Whole-buffer reads: one large write per chunk, however the
+            # decompressor's pipe happened to split its output
+            with memoryview(bufs[idx]) as mv:
+                n = _read_full(reader, mv, kill_event if dec else None)
+            # None: the read itself was cut off by the switch
+            if n is None or (kill_event and kill_event.is_set()):
+                log_lines.append("CANCELLED: stopping write")
+                cancelled = True
                 break
-            continue
-
-        ch = proc.stderr.read(1)
-        if not ch:
-            break
-        if ch in ("\r", "\n"):
-            line = buf.strip()
-            buf = ""
-            if not line:
-                continue
-            log_lines.append(line)
-            if len(log_lines) > 200:
-                log_lines.pop(0)
-            m = RE_BYTES.search(line)
-            if m and img_size > 0:
-                copied = int(m.group(1).replace(" ", ""))
-                progress = min(copied / img_size, 1.0)
+            if not n:
+                break
+            if pending:
+                pending.result()  # re-raises the writer's OSError
+            pending = pool.submit(_write_chunk, out_fd, bufs[idx], n)
+            idx ^= 1
+
+            written += n
+            consumed = src.seek(0, os.SEEK_CUR)
+            if img_size > 0:
+                progress = min(consumed / img_size, 1.0)
                 elapsed = time.time() - start
-                speed = copied / elapsed if elapsed > 0 else 0
-                eta = (img_size - copied) / speed if speed > 0 else 0
+                speed = written / elapsed if elapsed > 0 else 0
+                eta = elapsed * (1 - progress) / progress if progress > 0 else 0
+                if (bucket := int(speed) >> 16) != speed_bucket:  # 64 KiB/s steps
+                    speed_bucket, speed_human = bucket, _human_speed(speed)
+                if (bucket := int(eta)) != eta_bucket:            # whole seconds
+                    eta_bucket, eta_human = bucket, _human_eta(eta)
                 on_update({
                     "progress": round(progress, 4),
                     "speed_bytes": speed,
-                    "speed_human": _human_speed(speed),
+                    "speed_human": speed_human,
                     "eta_sec": round(eta, 1),
-                    "eta_human": _human_eta(eta),
+                    "eta_human": eta_human,
                 })
-        else:
-            buf += ch
 
-    proc.wait()
+        if pending:
+            pending.result()
+            pending = None
+        if not cancelled:
+            os.fsync(out_fd)
+            log_lines.append(f"{written} bytes copied")
+    except OSError as exc:
+        log_lines.append(f"ERROR: {exc}")
+        return False
+    finally:
+        # The in-flight write must finish before its fd and buffer go away
+        pool.shutdown(wait=True)
+        if out_fd >= 0:
+            os.close(out_fd)
+        if dec:
+            if cancelled:
+                dec.kill()
+            dec.stdout.close()
+            dec.wait()
+        if err_file is not None:
+            # The tail is enough for the error line
+            err_file.seek(max(err_file.seek(0, os.SEEK_END) - _ERR_TAIL, 0))
+            dec_err = err_file.read()
+            err_file.close()
+        if src is not None:
+            src.close()
+        for buf in bufs:
+            buf.close()
 
     if cancelled:
         return False
 
-    if proc.returncode != 0:
-        err = buf.strip() or f"dd exited with code {proc.returncode}"
-        log_lines.append(f"ERROR: {err}")
+    if dec and dec.returncode != 0:
+        err = dec_err.decode(errors="replace").strip()
+        log_lines.append(f"ERROR: {err or f'{dec_argv[0]} exited with code {dec.returncode}'}")
         return False
 
-    # Sync
-    subprocess.run(["sync"], timeout=30)
     on_update({"progress": 1.0, "speed_human": "--", "eta_human": "done"})
     return True
 
 
 # ── Verify stage ─────────────────────────────────────────────────────────────
 
+_HASH_CHUNK = 8 * 1024 * 1024
+
+# BLAKE3 (SIMD, multi-threaded) when installed; JANUS_VERIFY_HASH=sha256
+# forces SHA-256, e.g. where a FIPS-style digest is required.
+VERIFY_HASH = os.environ.get("JANUS_VERIFY_HASH", "blake3" if blake3 else "sha256").lower()
+if VERIFY_HASH not in ("blake3", "sha256") or (VERIFY_HASH == "blake3" and blake3 is None):
+    log.warning("verify hash %r unavailable, using sha256", VERIFY_HASH)
+    VERIFY_HASH = "sha256"
+_HASH_LABEL = {"blake3": "BLAKE3", "sha256": "SHA-256"}[VERIFY_HASH]
+
+
+def _new_hasher():
+    if VERIFY_HASH == "blake3":
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    return hashlib.sha256()
+
+
+def _open_noatime(path: str) -> int:
+    """O_RDONLY fd without atime updates (needs file ownership or root)."""
+    noatime = getattr(os, "O_NOATIME", 0)
+    if noatime:
+        try:
+            return os.open(path, os.O_RDONLY | noatime)
+        except PermissionError:
+            pass
+    return os.open(path, os.O_RDONLY)
+
+
+def _hash_file(path: str, size: int, on_chunk: Callable[[int], None],
+               kill_event: Optional[KillSwitch] = None,
+               drop_cache: bool = False) -> Optional[str]:
+    """
+    Digest (VERIFY_HASH) of the first `size` bytes of `path`.  Returns the
+    hex digest, or None if kill_event was set.  Runs in a worker thread: both
+    hashers release the GIL inside update(), so image and device can be
+    hashed concurrently.  With drop_cache, pages are evicted right after
+    hashing so a multi-GB read does not push everything else out of RAM.
+    """
+    sha = _new_hasher()
+    buf = bytearray(_HASH_CHUNK)
+    mv = memoryview(buf)
+    fadvise = hasattr(os, "posix_fadvise")
+    remaining = size
+    pos = 0
+    with open(_open_noatime(path), "rb", buffering=0) as f:
+        fd = f.fileno()
+        if fadvise:
+            # Pure streaming read: ask the kernel for aggressive read-ahead
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while remaining > 0:
+            if kill_event and kill_event.is_set():
+                return None
+            n = f.readinto(mv[:min(remaining, _HASH_CHUNK)])
+            if not n:
+                break
+            sha.update(mv[:n])
+            if drop_cache and fadvise:
+                os.posix_fadvise(fd, pos, n, os.POSIX_FADV_DONTNEED)
+            pos += n
+            remaining -= n
+            on_chunk(n)
+    return sha.hexdigest()
+
+
 def verify_image(image_path: str, device: str, on_update: UpdateCb,
-                 log_lines: list[str],
-                 kill_event: Optional[threading.Event] = None) -> bool:
-    """Compare sha256 of image vs written data on device."""
+                 log_lines: deque[str],
+                 kill_event: Optional[KillSwitch] = None) -> bool:
+    """Compare digests of image vs written data on device (both hashed in parallel)."""
     img_size = os.path.getsize(image_path)
     if img_size == 0:
         log_lines.append("WARN: image size is 0, skipping verify")
         return True
 
-    log_lines.append("Verifying: computing SHA-256 of image …")
+    on_update = _throttle(on_update)
+    log_lines.append(f"Verifying: computing {_HASH_LABEL} of image and device …")
     on_update({"progress": 0.0})
 
-    sha_img = hashlib.sha256()
-    read_so_far = 0
-    with open(image_path, "rb") as f:
-        while True:
-            if kill_event and kill_event.is_set():
-                log_lines.append("CANCELLED during verify")
-                return False
-            chunk = f.read(4 * 1024 * 1024)
-            if not chunk:
-                break
-            sha_img.update(chunk)
-            read_so_far += len(chunk)
-            on_update({"progress": round(read_so_far / (img_size * 2), 4)})
-
-    hex_img = sha_img.hexdigest()
-    log_lines.append(f"Image SHA-256: {hex_img}")
-
-    log_lines.append("Verifying: computing SHA-256 of device …")
-    sha_dev = hashlib.sha256()
-    read_so_far = 0
-    with open(device, "rb") as f:
-        while True:
-            if kill_event and kill_event.is_set():
-                log_lines.append("CANCELLED during verify (device read)")
-                return False
-            chunk = f.read(4 * 1024 * 1024)
-            if not chunk:
-                break
-            sha_dev.update(chunk)
-            read_so_far += len(chunk)
-            on_update({"progress": round(0.5 + read_so_far / (img_size * 2), 4)})
-            if read_so_far >= img_size:
-                break
+    # Progress is reported for the slower of the two streams
+    done = {"image": 0, "device": 0}
+    lock = threading.Lock()
+
+    def tracker(key: str) -> Callable[[int], None]:
+        def on_chunk(n: int):
+            with lock:
+                done[key] += n
+                slowest = min(done.values())
+            on_update({"progress": round(slowest / img_size, 4)})
+        return on_chunk
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="janus-verify") as pool:
+        fut_img = pool.submit(_hash_file, image_path, img_size, tracker("image"), kill_event)
+        # Device pages are never read again; the image's may be, by the
+        # next job flashing the same image, so only the device's are dropped
+        fut_dev = pool.submit(_hash_file, device, img_size, tracker("device"), kill_event,
+                              drop_cache=True)
+        hex_img = fut_img.result()
+        hex_dev = fut_dev.result()
+
+    if hex_img is None or hex_dev is None:
+        log_lines.append("CANCELLED during verify")
+        return False
 
-    hex_dev = sha_dev.hexdigest()
-    log_lines.append(f"Device SHA-256: {hex_dev}")
+    log_lines.append(f"Image {_HASH_LABEL}: {hex_img}")
+    log_lines.append(f"Device {_HASH_LABEL}: {hex_dev}")
 
     if hex_img == hex_dev:
         log_lines.append("Verify OK ✓")
@@ -218,26 +468,27 @@ def verify_image(image_path: str, device: str, on_update: UpdateCb,
 
 # ── Expand partition ─────────────────────────────────────────────────────────
 
+def _partitions(device: str, topology: Optional[dict[str, dict]]) -> list[dict]:
+    """Partition entries of device from an lsblk snapshot (fetched if None)."""
+    if topology is None:
+        topology = get_topology()
+    disk = topology.get(device)
+    if disk is None:
+        raise RuntimeError(f"{device} not found by lsblk")
+    return [ch for ch in (disk.get("children") or []) if ch.get("type") == "part"]
+
+
 def expand_partition(device: str, on_update: UpdateCb,
-                     log_lines: list[str],
-                     kill_event: Optional[threading.Event] = None) -> bool:
+                     log_lines: deque[str],
+                     kill_event: Optional[KillSwitch] = None,
+                     topology: Optional[dict[str, dict]] = None) -> bool:
     """Run growpart on the last partition of the device."""
     if kill_event and kill_event.is_set():
         return False
     on_update({"progress": 0.0})
     try:
         # Find last partition number
-        raw = subprocess.check_output(
-            ["lsblk", "-J", "-n", "-o", "NAME,TYPE", device],
-            text=True, timeout=10,
-        )
-        import json
-        data = json.loads(raw)
-        parts = []
-        for bd in data.get("blockdevices", []):
-            for ch in (bd.get("children") or []):
-                if ch.get("type") == "part":
-                    parts.append(ch["name"])
+        parts = [ch["name"] for ch in _partitions(device, topology)]
         if not parts:
             log_lines.append("WARN: no partitions found, skipping expand")
             on_update({"progress": 1.0})
@@ -245,7 +496,7 @@ def expand_partition(device: str, on_update: UpdateCb,
 
         last = parts[-1]
         # Extract partition number
-        m = re.search(r"(\d+)$", last)
+        m = _RE_PART_NUM.search(last)
         part_num = m.group(1) if m else "1"
 
         cmd = ["growpart", device, part_num]
@@ -271,26 +522,19 @@ def expand_partition(device: str, on_update: UpdateCb,
 # ── Resize filesystem ────────────────────────────────────────────────────────
 
 def resize_filesystem(device: str, on_update: UpdateCb,
-                      log_lines: list[str],
-                      kill_event: Optional[threading.Event] = None) -> bool:
+                      log_lines: deque[str],
+                      kill_event: Optional[KillSwitch] = None,
+                      topology: Optional[dict[str, dict]] = None) -> bool:
     """Run resize2fs on the last partition (if ext2/3/4)."""
     if kill_event and kill_event.is_set():
         return False
     on_update({"progress": 0.0})
     try:
-        raw = subprocess.check_output(
-            ["lsblk", "-J", "-n", "-o", "NAME,FSTYPE,TYPE", device],
-            text=True, timeout=10,
-        )
-        import json
-        data = json.loads(raw)
         last_part = None
         last_fs = None
-        for bd in data.get("blockdevices", []):
-            for ch in (bd.get("children") or []):
-                if ch.get("type") == "part":
-                    last_part = ch["name"]
-                    last_fs = ch.get("fstype") or ""
+        for ch in _partitions(device, topology):
+            last_part = ch["name"]
+            last_fs = ch.get("fstype") or ""
 
         if not last_part:
             log_lines.append("WARN: no partitions found, skipping resize")
@@ -3,12 +3,16 @@ Janus — Inventory service: drives, ports, images.
 """
 from __future__ import annotations
 
+import functools
 import json
 import logging
 import os
+import re
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, List, Optional, TypeVar
 
 from core.models import DriveInfo, ImageInfo
 
@@ -19,6 +23,42 @@ IMAGES_DIR = Path(os.environ.get("JANUS_IMAGES_DIR",
                                   str(Path(__file__).resolve().parent.parent / "images")))
 
 IMAGE_EXTENSIONS = {".img", ".iso", ".img.xz", ".img.gz", ".img.bz2", ".img.zst"}
+# Same set for str.endswith; compound suffixes first so .img.xz wins over .img
+_IMAGE_SUFFIXES = tuple(sorted(IMAGE_EXTENSIONS, key=len, reverse=True))
+
+# /dev/sda1 → /dev/sda  or /dev/mmcblk0p1 → /dev/mmcblk0
+_RE_ROOT = re.compile(r"(/dev/(?:sd[a-z]|nvme\d+n\d+|mmcblk\d+))")
+# by-path partition links: ...-part1, ...-lun-0-part2
+_RE_PART_LINK = re.compile(r"-part\d+$")
+# e.g. pci-0000:00:14.0-usb-0:5:1.0 → 0:5:1.0 (speed) / 0:5 (alias)
+_RE_USB_TOPO = re.compile(r'usb[v23]*-(\d+:\d+(?::\d+\.?\d*)*)')
+_RE_USB_ALIAS = re.compile(r'usb[v23]*-(\d+:\d+(?:\.\d+)?)')
+_RE_MOUNT_ESCAPE = re.compile(r"\\([0-7]{3})")  # mountinfo: space → \040
+
+_T = TypeVar("_T")
+
+
+# ── Enumeration cache ────────────────────────────────────────────────────────
+# The UI polls drives/ports several times per second; each miss forks lsblk
+# and walks /dev/disk/by-path, so results are reused for a short while.
+
+_TTL = 0.5  # seconds
+_cache: dict[str, tuple[float, Any]] = {}  # key → (time.monotonic(), value)
+
+
+def _cached(key: str, ttl: float, fn: Callable[[], _T]) -> _T:
+    hit = _cache.get(key)
+    now = time.monotonic()
+    if hit is not None and now - hit[0] < ttl:
+        return hit[1]
+    value = fn()
+    _cache[key] = (now, value)
+    return value
+
+
+def invalidate_inventory_cache():
+    """Forget cached drives/ports, e.g. after a mount change or hotplug."""
+    _cache.clear()
 
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
@@ -31,39 +71,257 @@ def _human_size(n: int) -> str:
     return f"{n:.1f} PB"
 
 
+@functools.lru_cache(maxsize=1)
+def _root_device() -> str:
+    # / does not move while we run; a failure raises and is not cached
+    out = subprocess.check_output(
+        ["findmnt", "-n", "-o", "SOURCE", "/"],
+        text=True, timeout=5,
+    ).strip()
+    m = _RE_ROOT.match(out)
+    return m.group(1) if m else out
+
+
 def _get_root_device() -> str:
     """Return the block device that holds /."""
     try:
-        out = subprocess.check_output(
-            ["findmnt", "-n", "-o", "SOURCE", "/"],
-            text=True, timeout=5,
-        ).strip()
-        # /dev/sda1 → /dev/sda  or /dev/mmcblk0p1 → /dev/mmcblk0
-        import re
-        m = re.match(r"(/dev/(?:sd[a-z]|nvme\d+n\d+|mmcblk\d+))", out)
-        return m.group(1) if m else out
+        return _root_device()
     except Exception:
         return ""
 
 
+_BY_PATH_DIR = "/dev/disk/by-path"
+
+
+def _by_path_names() -> list[str]:
+    try:
+        return os.listdir(_BY_PATH_DIR)
+    except OSError:
+        return []
+
+
+def _disk_link_names() -> list[str]:
+    """Sorted by-path names of whole disks; partition links filtered first."""
+    names = [n for n in _by_path_names() if not _RE_PART_LINK.search(n)]
+    names.sort()
+    return names
+
+
+def _link_target(name: str) -> str:
+    """
+    /dev/disk/by-path/<name> → /dev/sdX.  udev links are a single relative
+    hop (../../sda), so one readlink replaces a full realpath walk.
+    """
+    target = os.readlink(os.path.join(_BY_PATH_DIR, name))
+    return os.path.normpath(os.path.join(_BY_PATH_DIR, target))
+
+
 def _by_path_map() -> dict[str, str]:
     """Map /dev/sdX → /dev/disk/by-path/... ."""
+    return _cached("bp_map", _TTL, _scan_by_path)
+
+
+def _scan_by_path() -> dict[str, str]:
     result: dict[str, str] = {}
-    by_path = Path("/dev/disk/by-path")
-    if not by_path.is_dir():
-        return result
-    for link in by_path.iterdir():
+    # Only whole disks are looked up; partition links need no readlink
+    for name in _disk_link_names():
         try:
-            target = link.resolve()
-            result[str(target)] = str(link)
-        except Exception:
+            result[_link_target(name)] = os.path.join(_BY_PATH_DIR, name)
+        except OSError:
             pass
     return result
 
 
+# ── sysfs ────────────────────────────────────────────────────────────────────
+# Drive attributes come straight from /sys/block: the kernel serves these
+# small text files from memory, with none of lsblk's fork/exec and JSON.
+
+_SYS_BLOCK = "/sys/block"
+# Not whole disks in lsblk terms (TYPE loop / dm / raid / rom)
+_SKIP_BLOCK_PREFIXES = ("loop", "ram", "dm-", "md", "sr")
+
+# Substring of the sysfs device path → lsblk TRAN value
+_TRANSPORTS = (("/usb", "usb"), ("/nvme", "nvme"), ("/ata", "sata"), ("/mmc_host", "mmc"))
+
+
+_O_DIR = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+
+
+def _open_dir(path: str, dir_fd: Optional[int] = None) -> int:
+    """Directory fd for relative attribute reads, or -1 if it does not exist."""
+    try:
+        return os.open(path, _O_DIR, dir_fd=dir_fd)
+    except OSError:
+        return -1
+
+
+def _read_sysfs_attr(dir_fd: int, name: str) -> str:
+    """
+    Read a small sysfs attribute relative to an open directory: a single
+    open/read/close with no path walk from /.  Returns "" if it is absent.
+    """
+    if dir_fd < 0:
+        return ""
+    try:
+        fd = os.open(name, os.O_RDONLY, dir_fd=dir_fd)
+    except OSError:
+        return ""
+    try:
+        return os.read(fd, 4096).decode(errors="replace").strip()
+    except OSError:
+        return ""
+    finally:
+        os.close(fd)
+
+
+def _transport(sys_dir: str) -> str:
+    real = os.path.realpath(sys_dir)
+    for needle, tran in _TRANSPORTS:
+        if needle in real:
+            return tran
+    return ""
+
+
+def _udev_serial(devno: str) -> str:
+    """ID_SERIAL_SHORT from the udev database (USB sticks have no sysfs serial)."""
+    try:
+        with open(f"/run/udev/data/b{devno}") as f:
+            for line in f:
+                if line.startswith("E:ID_SERIAL_SHORT="):
+                    return line[18:].strip()
+    except OSError:
+        pass
+    return ""
+
+
+def _mount_table(path: str = "/proc/self/mountinfo") -> dict[str, list[str]]:
+    """
+    Map mount key → mountpoints, from one read of /proc/self/mountinfo.
+    Every mount is filed under its "major:minor" and, for /dev sources,
+    under the source path too: btrfs reports an anonymous 0:N number, so
+    only the source ties its mounts to the partition.
+    Raises OSError if mountinfo cannot be read.
+    """
+    result: dict[str, list[str]] = {}
+    with open(path) as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        fields = line.split(" ", 5)
+        if len(fields) < 5:
+            continue
+        mp = fields[4]
+        if "\\" in mp:
+            mp = _RE_MOUNT_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), mp)
+        # ... - fstype source superopts
+        tail = line.partition(" - ")[2].split(" ", 2)
+        keys = [fields[2]]
+        if len(tail) > 1 and tail[1].startswith("/dev/"):
+            keys.append(tail[1])
+        for key in keys:
+            mps = result.setdefault(key, [])
+            if mp not in mps:
+                mps.append(mp)
+    return result
+
+
+def _disk_mounts(blk_fd: int, name: str, table: dict[str, list[str]]) -> list[str]:
+    """
+    Mountpoints of the open /sys/block/<name> disk and its partitions,
+    matched by device number and by /dev source path (see _mount_table).
+    """
+    keys = [_read_sysfs_attr(blk_fd, "dev"), f"/dev/{name}"]
+    for part in os.scandir(blk_fd):
+        if part.name.startswith(name) and _read_sysfs_attr(blk_fd, f"{part.name}/partition"):
+            keys += (_read_sysfs_attr(blk_fd, f"{part.name}/dev"), f"/dev/{part.name}")
+    mounts: list[str] = []
+    for key in keys:
+        for mp in table.get(key, ()):
+            if mp not in mounts:
+                mounts.append(mp)
+    return mounts
+
+
 # ── Public API ───────────────────────────────────────────────────────────────
 
 def list_drives(removable_only: bool = False) -> List[DriveInfo]:
+    """List block devices (cached for _TTL seconds)."""
+    drives = _cached("drives", _TTL, _scan_drives)
+    if removable_only:
+        return [d for d in drives if d.removable]
+    return list(drives)
+
+
+def _scan_drives() -> List[DriveInfo]:
+    """List whole-disk block devices from sysfs, falling back to lsblk."""
+    try:
+        names = sorted(e.name for e in os.scandir(_SYS_BLOCK)
+                       if not e.name.startswith(_SKIP_BLOCK_PREFIXES))
+    except OSError:
+        names = []
+    if not names:
+        return _scan_drives_lsblk()
+
+    root_dev = _get_root_device()
+    bp_map = _by_path_map()
+    try:
+        mount_table = _mount_table()
+    except OSError:
+        mount_table = {}
+
+    result: List[DriveInfo] = []
+    for name in names:
+        sys_dir = os.path.join(_SYS_BLOCK, name)
+        blk_fd = _open_dir(sys_dir)
+        if blk_fd < 0:
+            continue  # unplugged while scanning
+        dev_fd = _open_dir("device", dir_fd=blk_fd)
+        try:
+            result.append(_sysfs_drive(name, sys_dir, blk_fd, dev_fd,
+                                       root_dev, bp_map, mount_table))
+        finally:
+            if dev_fd >= 0:
+                os.close(dev_fd)
+            os.close(blk_fd)
+
+    return result
+
+
+def _sysfs_drive(name: str, sys_dir: str, blk_fd: int, dev_fd: int,
+                 root_dev: str, bp_map: dict[str, str],
+                 mount_table: dict[str, list[str]]) -> DriveInfo:
+    """Build one DriveInfo from the open /sys/block/<name> and its device/ dir."""
+    dev_path = f"/dev/{name}"
+    devno = _read_sysfs_attr(blk_fd, "dev")
+    tran = _transport(sys_dir)
+    rm = _read_sysfs_attr(blk_fd, "removable") == "1" or tran == "usb"
+
+    # Mountpoints of the disk itself and of its partitions
+    mounts = _disk_mounts(blk_fd, name, mount_table)
+
+    is_sys = (dev_path == root_dev) or any(m == "/" for m in mounts)
+
+    try:
+        size_b = int(_read_sysfs_attr(blk_fd, "size") or 0) * 512
+    except ValueError:
+        size_b = 0
+    return DriveInfo(
+        device_path=dev_path,
+        by_path=bp_map.get(dev_path, ""),
+        model=_read_sysfs_attr(dev_fd, "model"),
+        serial=_read_sysfs_attr(dev_fd, "serial") or _udev_serial(devno),
+        vendor=_read_sysfs_attr(dev_fd, "vendor"),
+        size_bytes=size_b,
+        size_human=_human_size(size_b),
+        removable=rm,
+        mounted=len(mounts) > 0,
+        mountpoints=mounts,
+        usb_speed=tran,
+        port_path=bp_map.get(dev_path, ""),
+        is_system=is_sys,
+    )
+
+
+def _scan_drives_lsblk() -> List[DriveInfo]:
     """List block devices using lsblk."""
     try:
         raw = subprocess.check_output(
@@ -90,8 +348,6 @@ def list_drives(removable_only: bool = False) -> List[DriveInfo]:
             continue
         dev_path = f"/dev/{d['name']}"
         rm = bool(d.get("rm") or d.get("hotplug"))
-        if removable_only and not rm:
-            continue
 
         # Collect mountpoints from children
         mounts: list[str] = []
@@ -130,45 +386,66 @@ def list_drives(removable_only: bool = False) -> List[DriveInfo]:
     return result
 
 
+# path → (st_mtime_ns, st_size, ImageInfo); entries are rebuilt only when
+# the file changes, and dropped when it disappears
+_image_cache: dict[str, tuple[int, int, ImageInfo]] = {}
+
+
 def list_images() -> List[ImageInfo]:
     """Scan images directory for supported image files."""
+    global _image_cache
     IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-    result: List[ImageInfo] = []
-    for f in sorted(IMAGES_DIR.iterdir()):
-        if not f.is_file():
-            continue
-        # Check compound extensions like .img.xz
-        suffixes = "".join(f.suffixes)
-        if suffixes not in IMAGE_EXTENSIONS and f.suffix not in IMAGE_EXTENSIONS:
-            continue
-        stat = f.stat()
-        result.append(ImageInfo(
-            name=f.name,
-            path=str(f),
-            size_bytes=stat.st_size,
-            size_human=_human_size(stat.st_size),
-            mtime=stat.st_mtime,
-            img_type=suffixes.lstrip(".") or f.suffix.lstrip("."),
-        ))
-    return result
+    cache: dict[str, tuple[int, int, ImageInfo]] = {}
+    with os.scandir(IMAGES_DIR) as it:
+        for entry in it:
+            name = entry.name
+            # Compound extensions like .img.xz; dots earlier in the name
+            # (ubuntu-22.04.img.xz) do not matter
+            if not name.endswith(_IMAGE_SUFFIXES) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            hit = _image_cache.get(entry.path)
+            if hit and hit[0] == stat.st_mtime_ns and hit[1] == stat.st_size:
+                cache[entry.path] = hit
+                continue
+            suffix = next(ext for ext in _IMAGE_SUFFIXES if name.endswith(ext))
+            cache[entry.path] = (stat.st_mtime_ns, stat.st_size, ImageInfo(
+                name=name,
+                path=entry.path,
+                size_bytes=stat.st_size,
+                size_human=_human_size(stat.st_size),
+                mtime=stat.st_mtime,
+                img_type=suffix[1:],
+            ))
+    _image_cache = cache
+    return sorted((info for _, _, info in cache.values()), key=lambda i: i.name)
 
 
 def list_ports() -> list[dict]:
     """Return available USB port paths from /dev/disk/by-path (legacy, flat list)."""
-    bp = Path("/dev/disk/by-path")
-    if not bp.is_dir():
-        return []
     ports = []
-    for link in sorted(bp.iterdir()):
+    for name in sorted(_by_path_names()):
         try:
-            target = str(link.resolve())
-            ports.append({"port_path": str(link), "device": target})
-        except Exception:
+            ports.append({"port_path": os.path.join(_BY_PATH_DIR, name),
+                          "device": _link_target(name)})
+        except OSError:
             pass
     return ports
 
 
+_SPEED_TTL = 5.0  # seconds a port's detected USB speed is reused
+
+
 def _usb_speed_from_path(port_path: str) -> str:
+    """
+    USB version for a by-path port, cached for _SPEED_TTL: the same port
+    path comes back when another stick is plugged in, possibly at another
+    speed, and no hotplug event may have cleared the cache.
+    """
+    return _cached(f"speed:{port_path}", _SPEED_TTL, lambda: _detect_usb_speed(port_path))
+
+
+def _detect_usb_speed(port_path: str) -> str:
     """Detect USB version from by-path string topology."""
     p = port_path.lower()
     if "usb3" in p or "usbv3" in p:
@@ -177,9 +454,8 @@ def _usb_speed_from_path(port_path: str) -> str:
         return "2.0"
     # Try to read speed from sysfs using the USB topology
     # e.g. pci-0000:00:14.0-usb-0:5:1.0 -> bus 0:5 -> /sys/bus/usb/devices/...
-    import re
     # Extract topology like 0:5:1.0 from path
-    m = re.search(r'usb[v23]*-(\d+:\d+(?::\d+\.?\d*)*)', port_path)
+    m = _RE_USB_TOPO.search(port_path)
     if m:
         topo = m.group(1)
         parts = topo.split(":")
@@ -204,22 +480,29 @@ def _usb_speed_from_path(port_path: str) -> str:
     return "unknown"
 
 
+@functools.lru_cache(maxsize=512)  # a pure function of the path string
 def _short_port_alias(port_path: str) -> str:
     """
     Generate a human-readable short alias from the by-path string.
     e.g. /dev/disk/by-path/pci-0000:00:14.0-usb-0:3:1.0-scsi-0:0:0:0
          → 'USB 0:3'
     """
-    import re
     name = Path(port_path).name
     # Match USB topology pattern
-    m = re.search(r'usb[v23]*-(\d+:\d+(?:\.\d+)?)', name)
+    m = _RE_USB_ALIAS.search(name)
     if m:
         return f"USB {m.group(1)}"
     # Fallback: last 20 chars
     return name[-20:] if len(name) > 20 else name
 
 
+def invalidate_port_caches():
+    """Forget detected per-port speeds, e.g. after a USB hotplug."""
+    for key in list(_cache):
+        if key.startswith("speed:"):
+            _cache.pop(key, None)
+
+
 def list_physical_ports() -> list[dict]:
     """
     Return a deduplicated list of physical USB ports (disk-level only, no partition entries).
@@ -234,48 +517,34 @@ def list_physical_ports() -> list[dict]:
       device_serial - serial (or "")
       occupied    - bool: a drive is currently plugged in this port
     """
-    bp = Path("/dev/disk/by-path")
-    if not bp.is_dir():
+    return list(_cached("ports", _TTL, _scan_physical_ports))
+
+
+def _scan_physical_ports() -> list[dict]:
+    # Skip partition entries (end in -partN, incl. scsi lun-N-partN)
+    names = _disk_link_names()
+    if not names:
         return []
 
-    # Build reverse map: by_path → DriveInfo
-    drives = list_drives(removable_only=False)
-    drive_by_bypath: dict[str, "DriveInfo"] = {}
-    for d in drives:
+    # One index, two keys per drive: by_path and /dev/sdX → DriveInfo
+    drive_index: dict[str, DriveInfo] = {}
+    for d in list_drives(removable_only=False):
+        drive_index[d.device_path] = d
         if d.by_path:
-            drive_by_bypath[d.by_path] = d
+            drive_index[d.by_path] = d
 
-    seen: set[str] = set()
     result: list[dict] = []
 
-    import re
-    for link in sorted(bp.iterdir()):
-        name = link.name
-        # Skip partition entries (end in -partN)
-        if re.search(r'-part\d+$', name):
-            continue
-        # Also skip scsi-lun entries that are partition-like
-        if re.search(r'lun-\d+-part\d+$', name):
-            continue
-
-        port_path = str(link)
-        if port_path in seen:
-            continue
-        seen.add(port_path)
+    for name in names:
+        port_path = os.path.join(_BY_PATH_DIR, name)
 
         try:
-            dev_target = str(link.resolve())
-        except Exception:
+            dev_target = _link_target(name)
+        except OSError:
             dev_target = ""
 
-        # Find the drive for this port
-        drive = drive_by_bypath.get(port_path)
-        # Also try to match by resolved device path
-        if not drive and dev_target:
-            for d in drives:
-                if d.device_path == dev_target:
-                    drive = d
-                    break
+        # Find the drive for this port, by link or by resolved device path
+        drive = drive_index.get(port_path) or drive_index.get(dev_target)
 
         usb_speed = _usb_speed_from_path(port_path)
 
@@ -296,8 +565,39 @@ def list_physical_ports() -> list[dict]:
     return result
 
 
+def _umount(dev: str) -> str:
+    """umount one device; returns the error message, "" on success."""
+    try:
+        subprocess.check_call(["umount", dev], timeout=15)
+        return ""
+    except Exception as exc:
+        return str(exc)
+
+
+def _has_any_mount(device_path: str) -> bool:
+    """
+    True if device_path or one of its partitions is mounted (by device
+    number or /dev source, as in the drive scan).  Also True when that
+    cannot be told (no sysfs entry, unreadable mountinfo), so the caller
+    goes on to the full unmount.
+    """
+    name = os.path.basename(os.path.realpath(device_path))  # by-path links too
+    blk_fd = _open_dir(os.path.join(_SYS_BLOCK, name))
+    if blk_fd < 0:
+        return True
+    try:
+        return bool(_disk_mounts(blk_fd, name, _mount_table()))
+    except OSError:
+        return True
+    finally:
+        os.close(blk_fd)
+
+
 def unmount_device(device_path: str) -> tuple[bool, str]:
     """Attempt to unmount all partitions of a device."""
+    # A fresh stick usually has nothing mounted: no lsblk fork for it
+    if not _has_any_mount(device_path):
+        return True, "no mounts"
     try:
         # Find partitions
         raw = subprocess.check_output(
@@ -305,15 +605,22 @@ def unmount_device(device_path: str) -> tuple[bool, str]:
             text=True, timeout=10,
         )
         data = json.loads(raw)
-        for bd in data.get("blockdevices", []):
-            for child in (bd.get("children") or [bd]):
-                mp = child.get("mountpoint")
-                if mp:
-                    dev = f"/dev/{child['name']}"
-                    subprocess.check_call(["umount", dev], timeout=15)
+        devs = [f"/dev/{child['name']}"
+                for bd in data.get("blockdevices", [])
+                for child in (bd.get("children") or [bd])
+                if child.get("mountpoint")]
+        if not devs:
+            return True, "OK"
+        # Partitions are independent: unmount them side by side
+        with ThreadPoolExecutor(max_workers=min(8, len(devs))) as pool:
+            errors = [err for err in pool.map(_umount, devs) if err]
+        if errors:
+            return False, "; ".join(errors)
         return True, "OK"
     except Exception as exc:
         return False, str(exc)
+    finally:
+        invalidate_inventory_cache()
 
 
 def eject_device(device_path: str) -> tuple[bool, str]:
@@ -336,4 +643,6 @@ def eject_device(device_path: str) -> tuple[bool, str]:
             return False, str(exc)
     except Exception as exc:
         return False, str(exc)
-
+    finally:
+        invalidate_inventory_cache()
+        invalidate_port_caches()  # the port's negotiated speed goes with the device
@@ -5,90 +5,109 @@ from __future__ import annotations
 
 import asyncio
 import logging
-import threading
 import time
 import uuid
 from typing import Dict, List, Optional
 
 from core.event_bus import event_bus
 from core.flash_runner import (
+    KillSwitch,
+    clear_device_size_cache,
     expand_partition,
     resize_filesystem,
     verify_image,
     write_image,
 )
-from core.inventory_service import eject_device, list_drives, unmount_device
+from core.inventory_service import eject_device, list_drives, list_images, unmount_device
 from core.layout_service import get_layout
+from core.lsblk_cache import get_topology, invalidate as invalidate_topology
 from core.models import (
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_EXPANDING,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RESIZING,
+    JOB_VERIFYING,
+    JOB_WRITING,
+    STAGE_EXPAND,
+    STAGE_RESIZE,
+    STAGE_VERIFY,
+    STAGE_WRITE,
     BatchInfo,
     BatchOptions,
     BatchStartRequest,
-    JobInfo,
-    JobStage,
-    JobState,
+    JobRecord,
 )
 
 log = logging.getLogger("janus.jobs")
 
+PUBLISH_INTERVAL = 0.05  # seconds; job changes go out as one job_updates frame per interval
+
 
 class JobManager:
     """Manages flash jobs with concurrency limiting."""
 
     def __init__(self):
-        self._jobs: Dict[str, JobInfo] = {}
+        self._jobs: Dict[str, JobRecord] = {}
         self._batches: Dict[str, BatchInfo] = {}
         self._tasks: Dict[str, asyncio.Task] = {}
         self._semaphore: Optional[asyncio.Semaphore] = None
-        self._cancel_flags: Dict[str, bool] = {}
-        self._kill_events: Dict[str, threading.Event] = {}
+        self._kill_events: Dict[str, KillSwitch] = {}
+        # Publisher: jobs changed since the last frame, with whether the
+        # full job (True) or just its progress is due
+        self._publish_ready: Optional[asyncio.Event] = None
+        self._publish_pending: Dict[str, tuple[JobRecord, bool]] = {}
+        self._publisher: Optional[asyncio.Task] = None
 
     # ── Public API ───────────────────────────────────────────────────────
 
-    def list_jobs(self) -> List[JobInfo]:
+    def list_jobs(self) -> List[JobRecord]:
         return list(self._jobs.values())
 
-    def get_job(self, job_id: str) -> Optional[JobInfo]:
+    def get_job(self, job_id: str) -> Optional[JobRecord]:
         return self._jobs.get(job_id)
 
-    async def start_batch(self, req: BatchStartRequest) -> List[JobInfo]:
+    async def start_batch(self, req: BatchStartRequest) -> List[JobRecord]:
         """Create jobs for selected cells and start them with concurrency."""
         layout = get_layout()
         cell_map = {c.cell_id: c for c in layout.cells}
-        drives = list_drives()
+        # port_id may be a by-path link or a /dev path: index drives by both
         drive_by_path = {}
-        for d in drives:
+        for d in list_drives():
             drive_by_path[d.device_path] = d
             if d.by_path:
                 drive_by_path[d.by_path] = d
+        resolved = {
+            cid: (cell, drive_by_path.get(cell.port_id))
+            for cid in req.cell_ids
+            if (cell := cell_map.get(cid)) is not None and cell.enabled
+        }
 
+        now = time.time()  # one clock read for the batch and the jobs it rejects
         batch_id = str(uuid.uuid4())
-        batch = BatchInfo(
+        # req was validated at the API boundary: no need to validate it again
+        batch = BatchInfo.model_construct(
             batch_id=batch_id,
             image_name=req.image_name,
             options=req.options,
             concurrency=req.concurrency,
             cell_ids=req.cell_ids,
+            created_at=now,
         )
         self._batches[batch_id] = batch
 
         self._semaphore = asyncio.Semaphore(max(1, req.concurrency))
 
-        created_jobs: List[JobInfo] = []
-        for cell_id in req.cell_ids:
-            cell = cell_map.get(cell_id)
-            if not cell or not cell.enabled:
-                continue
-
-            # Resolve device from port_id
-            drive = drive_by_path.get(cell.port_id)
-            if not drive:
-                # Try to find by device_path directly
-                drive = drive_by_path.get(cell.port_id)
+        # Same image for every job of the batch: look it up once
+        image_path = _find_image_path(req.image_name)
 
+        created_jobs: List[JobRecord] = []
+        for cell_id, (cell, drive) in resolved.items():
             device_path = drive.device_path if drive else cell.port_id
 
             job_id = str(uuid.uuid4())
-            job = JobInfo(
+            job = JobRecord(
                 job_id=job_id,
                 cell_id=cell_id,
                 device_path=device_path,
@@ -98,20 +117,20 @@ class JobManager:
             # Safety checks
             error = self._safety_check(drive, device_path)
             if error:
-                job.state = JobState.FAILED
+                job.state = JOB_FAILED
                 job.error = error
+                job.finished_at = now
                 self._jobs[job_id] = job
                 created_jobs.append(job)
-                await self._publish_update(job)
+                self._publish_update(job)
                 continue
 
             self._jobs[job_id] = job
-            self._cancel_flags[job_id] = False
-            self._kill_events[job_id] = threading.Event()
+            self._kill_events[job_id] = KillSwitch()
             created_jobs.append(job)
 
             task = asyncio.create_task(
-                self._run_job(job, req.options)
+                self._run_job(job, req.options, image_path)
             )
             self._tasks[job_id] = task
 
@@ -134,31 +153,30 @@ class JobManager:
         job = self._jobs.get(job_id)
         if not job:
             return False
-        if job.state in (JobState.DONE, JobState.FAILED, JobState.CANCELLED):
+        if job.state in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
             return False
-        self._cancel_flags[job_id] = True
         # Signal the worker thread to kill the subprocess immediately
         kill_ev = self._kill_events.get(job_id)
         if kill_ev:
             kill_ev.set()
-        job.state = JobState.CANCELLED
+        job.state = JOB_CANCELLED
         job.finished_at = time.time()
         task = self._tasks.get(job_id)
         if task and not task.done():
             task.cancel()
-        await self._publish_update(job)
+        self._publish_update(job)
         return True
 
-    async def retry_job(self, job_id: str) -> Optional[JobInfo]:
+    async def retry_job(self, job_id: str) -> Optional[JobRecord]:
         old = self._jobs.get(job_id)
         if not old:
             return None
-        if old.state not in (JobState.FAILED, JobState.CANCELLED):
+        if old.state not in (JOB_FAILED, JOB_CANCELLED):
             return None
 
         # Create a new job for the same cell
         new_id = str(uuid.uuid4())
-        job = JobInfo(
+        job = JobRecord(
             job_id=new_id,
             cell_id=old.cell_id,
             device_path=old.device_path,
@@ -173,20 +191,19 @@ class JobManager:
                 break
         error = self._safety_check(drive, old.device_path)
         if error:
-            job.state = JobState.FAILED
+            job.state = JOB_FAILED
             job.error = error
             self._jobs[new_id] = job
-            await self._publish_update(job)
+            self._publish_update(job)
             return job
 
         self._jobs[new_id] = job
-        self._cancel_flags[new_id] = False
-        self._kill_events[new_id] = threading.Event()
+        self._kill_events[new_id] = KillSwitch()
         # Remove old job
         self._jobs.pop(job_id, None)
 
         # Reconstruct options from batch or use defaults
-        options = BatchOptions()
+        options = BatchOptions.model_construct()
         for b in self._batches.values():
             if old.cell_id in b.cell_ids:
                 options = b.options
@@ -218,18 +235,19 @@ class JobManager:
         if not dev:
             return False, "Device not connected"
 
+        clear_device_size_cache()
         return eject_device(dev.device_path)
 
     async def cancel_all(self):
         for job_id, job in list(self._jobs.items()):
-            if job.state in (JobState.QUEUED, JobState.WRITING, JobState.VERIFYING,
-                             JobState.EXPANDING, JobState.RESIZING):
+            if job.state in (JOB_QUEUED, JOB_WRITING, JOB_VERIFYING,
+                             JOB_EXPANDING, JOB_RESIZING):
                 await self.cancel_job(job_id)
 
-    async def retry_all_failed(self) -> List[JobInfo]:
+    async def retry_all_failed(self) -> List[JobRecord]:
         retried = []
         for job_id, job in list(self._jobs.items()):
-            if job.state == JobState.FAILED:
+            if job.state == JOB_FAILED:
                 new_job = await self.retry_job(job_id)
                 if new_job:
                     retried.append(new_job)
@@ -237,33 +255,37 @@ class JobManager:
 
     # ── Internal ─────────────────────────────────────────────────────────
 
-    async def _run_job(self, job: JobInfo, options: BatchOptions):
+    async def _run_job(self, job: JobRecord, options: BatchOptions,
+                       image_path: Optional[str] = None):
         """Execute the full flash pipeline for one job."""
         assert self._semaphore is not None
-        async with self._semaphore:
-            if self._cancel_flags.get(job.job_id):
-                return
-            await self._execute_pipeline(job, options)
-
-    async def _execute_pipeline(self, job: JobInfo, options: BatchOptions):
-        """Run write → verify → expand → resize pipeline in a thread."""
-        from core.inventory_service import list_images
-
+        try:
+            async with self._semaphore:
+                kill_event = self._kill_events.get(job.job_id)
+                if kill_event and kill_event.is_set():
+                    return  # cancelled while queued
+                await self._execute_pipeline(job, options, image_path)
+        finally:
+            # A worker thread may still hold the switch; its pipe is closed
+            # when the last reference goes away
+            self._kill_events.pop(job.job_id, None)
+
+    async def _execute_pipeline(self, job: JobRecord, options: BatchOptions,
+                                image_path: Optional[str] = None):
+        """
+        Run write → verify → expand → resize pipeline in a thread.
+        image_path is resolved from job.image_name if the caller did not.
+        """
         job.started_at = time.time()
         log_lines = job.log_tail
 
-        # Resolve image path
-        images = list_images()
-        image_path = None
-        for img in images:
-            if img.name == job.image_name:
-                image_path = img.path
-                break
+        if image_path is None:
+            image_path = _find_image_path(job.image_name)
         if not image_path:
-            job.state = JobState.FAILED
+            job.state = JOB_FAILED
             job.error = f"Image '{job.image_name}' not found"
             job.finished_at = time.time()
-            await self._publish_update(job)
+            self._publish_update(job)
             return
 
         device = job.device_path
@@ -277,79 +299,88 @@ class JobManager:
         loop = asyncio.get_running_loop()
         kill_event = self._kill_events.get(job.job_id)
 
-        def make_update_cb(stage: JobStage):
+        def make_update_cb(stage: str):
             def cb(fields: dict):
                 job.stage = stage
                 for k, v in fields.items():
                     if hasattr(job, k):
                         setattr(job, k, v)
-                # Schedule publish on the main event loop from the worker thread
+                # Hand the publish to the event loop; the worker thread
+                # does not wait for it
                 try:
-                    asyncio.run_coroutine_threadsafe(self._publish_update(job), loop)
-                except Exception:
-                    pass
+                    loop.call_soon_threadsafe(self._publish_update, job, True)
+                except RuntimeError:
+                    pass  # loop already closed (shutdown)
             return cb
 
         # ── WRITE ────────────────────────────────────────────────────
-        job.state = JobState.WRITING
-        job.stage = JobStage.WRITE
+        job.state = JOB_WRITING
+        job.stage = STAGE_WRITE
         job.progress = 0.0
-        await self._publish_update(job)
+        self._publish_update(job)
 
         success = await asyncio.to_thread(
             write_image, image_path, device,
-            make_update_cb(JobStage.WRITE), log_lines, kill_event
+            make_update_cb(STAGE_WRITE), log_lines, kill_event
         )
-        if self._cancel_flags.get(job.job_id) or (kill_event and kill_event.is_set()):
-            job.state = JobState.CANCELLED
+        if kill_event and kill_event.is_set():
+            job.state = JOB_CANCELLED
             job.finished_at = time.time()
-            await self._publish_update(job)
+            self._publish_update(job)
             return
         if not success:
-            job.state = JobState.FAILED
+            job.state = JOB_FAILED
             job.error = "Write failed"
             job.finished_at = time.time()
-            await self._publish_update(job)
+            self._publish_update(job)
             return
 
+        # The partition table was just rewritten: older lsblk snapshots are stale
+        invalidate_topology()
+
         # ── VERIFY ───────────────────────────────────────────────────
         if options.verify:
-            job.state = JobState.VERIFYING
-            job.stage = JobStage.VERIFY
+            job.state = JOB_VERIFYING
+            job.stage = STAGE_VERIFY
             job.progress = 0.0
-            await self._publish_update(job)
+            self._publish_update(job)
 
             success = await asyncio.to_thread(
                 verify_image, image_path, device,
-                make_update_cb(JobStage.VERIFY), log_lines, kill_event
+                make_update_cb(STAGE_VERIFY), log_lines, kill_event
             )
-            if self._cancel_flags.get(job.job_id) or (kill_event and kill_event.is_set()):
-                job.state = JobState.CANCELLED
+            if kill_event and kill_event.is_set():
+                job.state = JOB_CANCELLED
                 job.finished_at = time.time()
-                await self._publish_update(job)
+                self._publish_update(job)
                 return
             if not success:
-                job.state = JobState.FAILED
+                job.state = JOB_FAILED
                 job.error = "Verification failed"
                 job.finished_at = time.time()
-                await self._publish_update(job)
+                self._publish_update(job)
                 return
 
+        # One lsblk snapshot (shared with concurrent jobs) serves expand + resize
+        topology = None
+        if options.expand_partition or options.resize_filesystem:
+            topology = await asyncio.to_thread(get_topology)
+
         # ── EXPAND ───────────────────────────────────────────────────
         if options.expand_partition:
             if kill_event and kill_event.is_set():
-                job.state = JobState.CANCELLED
+                job.state = JOB_CANCELLED
                 job.finished_at = time.time()
-                await self._publish_update(job)
+                self._publish_update(job)
                 return
-            job.state = JobState.EXPANDING
-            job.stage = JobStage.EXPAND
+            job.state = JOB_EXPANDING
+            job.stage = STAGE_EXPAND
             job.progress = 0.0
-            await self._publish_update(job)
+            self._publish_update(job)
 
             success = await asyncio.to_thread(
                 expand_partition, device,
-                make_update_cb(JobStage.EXPAND), log_lines, kill_event
+                make_update_cb(STAGE_EXPAND), log_lines, kill_event, topology
             )
             if not success:
                 job.warning = "Expand partition failed (non-fatal)"
@@ -358,40 +389,90 @@ class JobManager:
         # ── RESIZE ───────────────────────────────────────────────────
         if options.resize_filesystem:
             if kill_event and kill_event.is_set():
-                job.state = JobState.CANCELLED
+                job.state = JOB_CANCELLED
                 job.finished_at = time.time()
-                await self._publish_update(job)
+                self._publish_update(job)
                 return
-            job.state = JobState.RESIZING
-            job.stage = JobStage.RESIZE
+            job.state = JOB_RESIZING
+            job.stage = STAGE_RESIZE
             job.progress = 0.0
-            await self._publish_update(job)
+            self._publish_update(job)
 
             success = await asyncio.to_thread(
                 resize_filesystem, device,
-                make_update_cb(JobStage.RESIZE), log_lines, kill_event
+                make_update_cb(STAGE_RESIZE), log_lines, kill_event, topology
             )
             if not success:
                 job.warning = (job.warning or "") + "; Resize failed (non-fatal)"
                 log_lines.append("WARN: resize failed, continuing")
 
         # ── DONE ─────────────────────────────────────────────────────
-        job.state = JobState.DONE
+        job.state = JOB_DONE
         job.progress = 1.0
         job.finished_at = time.time()
-        await self._publish_update(job)
+        self._publish_update(job)
 
         # ── EJECT ────────────────────────────────────────────────────
         if options.eject_after_done:
+            clear_device_size_cache()
             ok, msg = await asyncio.to_thread(eject_device, device)
             if ok:
                 log_lines.append("Ejected successfully")
             else:
                 log_lines.append(f"WARN: eject: {msg}")
-            await self._publish_update(job)
-
-    async def _publish_update(self, job: JobInfo):
-        await event_bus.publish("job_update", job.model_dump())
+            self._publish_update(job)
+
+    def _publish_update(self, job: JobRecord, progress_only: bool = False):
+        """
+        Mark job for the next job_updates frame; must be called on the event
+        loop.  A job already marked is dumped once when the frame is built,
+        however many times it changed in between.  With progress_only, only
+        a patch of PROGRESS_FIELDS is sent, unless a full update is due anyway.
+        """
+        pending = self._publish_pending.get(job.job_id)
+        if pending is not None:
+            if not progress_only:
+                self._publish_pending[job.job_id] = (job, True)
+            return
+        if self._publisher is None or self._publisher.done():
+            # Started lazily: the singleton is created before the loop runs
+            self._publish_ready = asyncio.Event()
+            self._publisher = asyncio.create_task(self._publish_loop())
+        self._publish_pending[job.job_id] = (job, not progress_only)
+        self._publish_ready.set()
+
+    async def _publish_loop(self):
+        assert self._publish_ready is not None
+        while True:
+            await self._publish_ready.wait()
+            # Let the burst collect: every job that changes meanwhile rides
+            # in the same frame
+            await asyncio.sleep(PUBLISH_INTERVAL)
+            self._publish_ready.clear()
+            pending, self._publish_pending = self._publish_pending, {}
+            try:
+                updates = []
+                for job_id, (job, full) in pending.items():
+                    if full:
+                        # Read before dumping: a line added meanwhile also goes in the next frame
+                        tail = job.log_tail
+                        seen = tail.appended
+                        with_log = seen != tail.published
+                        tail.published = seen
+                        updates.append(job.to_dict(with_log))
+                    else:
+                        updates.append({"job_id": job_id, "patch": job.progress_dump()})
+                # No key: a batch must not replace an unsent one, the jobs differ
+                await event_bus.publish("job_updates", {"updates": updates})
+            except Exception:
+                log.exception("publish of %d job updates failed", len(pending))
+
+
+def _find_image_path(image_name: str) -> Optional[str]:
+    for img in list_images():
+        if img.name == image_name:
+            return img.path
+    return None
 
 
 # Global singleton
@@ -3,17 +3,30 @@ Janus — Layout service: load/save grid configuration.
 """
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
+import os
 from pathlib import Path
+from typing import Optional
 
-from core.models import LayoutConfig, PortCell, UsbHint
+import orjson
+
+from core.models import LayoutConfig, LayoutSoA, PortCell, UsbHint
 
 log = logging.getLogger("janus.layout")
 
 DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 LAYOUT_FILE = DATA_DIR / "layout.json"
 
+# ((st_mtime_ns, st_size) of LAYOUT_FILE, parsed layout)
+_layout_cache: Optional[tuple[tuple[int, int], LayoutConfig]] = None
+# (digest of the bytes we last wrote, file key right after writing them)
+_last_written: Optional[tuple[bytes, tuple[int, int]]] = None
+# (layout it was built from, get_layout_columns() result); get_layout()
+# returns the same object for as long as the file is unchanged
+_columns_cache: Optional[tuple[LayoutConfig, dict]] = None
+
 
 def _default_layout() -> LayoutConfig:
     """Generate a sensible default layout (2 rows × 4 cols = 8 cells)."""
@@ -36,26 +49,94 @@ def ensure_data_dir():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def get_layout() -> LayoutConfig:
+def _file_key() -> tuple[int, int]:
+    st = LAYOUT_FILE.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def ensure_layout_file():
+    """Write the default layout if there is none; an existing file is not parsed."""
     ensure_data_dir()
     if not LAYOUT_FILE.exists():
+        save_layout(_default_layout())
+
+
+def get_layout() -> LayoutConfig:
+    """Parsed layout; re-read only when layout.json changes on disk."""
+    global _layout_cache
+    ensure_data_dir()
+    try:
+        key = _file_key()
+    except FileNotFoundError:
         layout = _default_layout()
         save_layout(layout)
         return layout
+    if _layout_cache is not None and _layout_cache[0] == key:
+        return _layout_cache[1]
     try:
         data = json.loads(LAYOUT_FILE.read_text(encoding="utf-8"))
-        return LayoutConfig(**data)
+        layout = LayoutConfig(**data)
     except Exception as exc:
         log.warning("Failed to parse layout.json, using default: %s", exc)
-        return _default_layout()
+        layout = _default_layout()
+    _layout_cache = (key, layout)
+    return layout
+
+
+def get_layout_columns() -> dict:
+    """Current layout with its cells as columns (LayoutSoA), JSON-ready."""
+    global _columns_cache
+    layout = get_layout()
+    if _columns_cache is None or _columns_cache[0] is not layout:
+        soa = LayoutSoA.from_layout(layout)
+        _columns_cache = (layout, {
+            "schema_version": layout.schema_version,
+            "rows": layout.rows,
+            "cols": layout.cols,
+            "cell_size": layout.cell_size,
+            "cell_ids": soa.cell_ids,
+            "labels": soa.labels,
+            "port_ids": soa.port_ids,
+            "usb_hints": soa.usb_hints,
+            "enabled": soa.enabled,
+        })
+    return _columns_cache[1]
+
+
+def _dump(layout: LayoutConfig) -> bytes:
+    return orjson.dumps(layout.model_dump(mode="json"), option=orjson.OPT_INDENT_2)
 
 
 def save_layout(layout: LayoutConfig):
+    global _layout_cache, _last_written
     ensure_data_dir()
-    LAYOUT_FILE.write_text(
-        layout.model_dump_json(indent=2),
-        encoding="utf-8",
-    )
+    blob = _dump(layout)
+    digest = hashlib.blake2b(blob, digest_size=16).digest()
+    try:
+        key = _file_key()
+    except FileNotFoundError:
+        key = None
+    if _last_written is not None and _last_written == (digest, key):
+        # Same bytes as our last write, and nobody touched the file since
+        _layout_cache = (key, layout)
+        return
+
+    # Write-then-rename: a crash mid-write never leaves a truncated layout
+    tmp = LAYOUT_FILE.with_suffix(".json.tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        mv = memoryview(blob)
+        while mv:
+            mv = mv[os.write(fd, mv):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, LAYOUT_FILE)
+
+    key = _file_key()
+    _last_written = (digest, key)
+    # What was just written is what the next get_layout() would parse
+    _layout_cache = (key, layout)
     log.info("Layout saved (%d cells)", len(layout.cells))
 
 
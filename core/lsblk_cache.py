@@ -0,0 +1,49 @@
+"""
+Janus — shared lsblk snapshot for the post-write stages (expand / resize).
+"""
+from __future__ import annotations
+
+import json
+import logging
+import subprocess
+import threading
+import time
+
+log = logging.getLogger("janus.lsblk")
+
+TTL = 2.0  # seconds a snapshot is reused by concurrent jobs
+
+_lock = threading.Lock()
+_snapshot: dict[str, dict] = {}
+_taken_at = 0.0  # time.monotonic() of _snapshot; 0 = invalid
+
+
+def get_topology() -> dict[str, dict]:
+    """
+    Map /dev/sdX → lsblk disk entry (NAME, TYPE, FSTYPE, children).
+    One lsblk call serves every job that asks within TTL; callers arriving
+    while it runs wait for its result.  Returns {} if lsblk fails.
+    """
+    global _snapshot, _taken_at
+    with _lock:
+        if _taken_at and time.monotonic() - _taken_at < TTL:
+            return _snapshot
+        try:
+            raw = subprocess.check_output(
+                ["lsblk", "-J", "-o", "NAME,TYPE,FSTYPE"],
+                text=True, timeout=10,
+            )
+        except Exception as exc:
+            log.error("lsblk failed: %s", exc)
+            return {}
+        data = json.loads(raw)
+        _snapshot = {f"/dev/{bd['name']}": bd for bd in data.get("blockdevices", [])}
+        _taken_at = time.monotonic()
+        return _snapshot
+
+
+def invalidate():
+    """Drop the snapshot, e.g. after a partition table was rewritten."""
+    global _taken_at
+    with _lock:
+        _taken_at = 0.0
@@ -4,10 +4,20 @@ Janus — модели данных.
 from __future__ import annotations
 
 import time
+from collections import deque
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Optional
+from operator import attrgetter
+from typing import Deque, List, Optional, TypedDict
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, field_serializer
+
+
+# Models built only inside Janus set defer_build: their validator/serializer
+# is built on first use, not at import, so startup only pays for the models
+# a run touches.  Request bodies (and the models nested in them) are built
+# eagerly: FastAPI wraps them in its own TypeAdapter anyway.  So are the
+# ones dumped on hot paths (see the end of the module).
 
 
 # ── Enums ────────────────────────────────────────────────────────────────────
@@ -30,6 +40,23 @@ class JobStage(str, Enum):
     RESIZE = "resize"
 
 
+# Plain-str values, bound once.  JobRecord stores these rather than the
+# members: they compare equal to them (str, Enum) and go into JSON as is.
+JOB_QUEUED = JobState.QUEUED.value
+JOB_WRITING = JobState.WRITING.value
+JOB_VERIFYING = JobState.VERIFYING.value
+JOB_EXPANDING = JobState.EXPANDING.value
+JOB_RESIZING = JobState.RESIZING.value
+JOB_DONE = JobState.DONE.value
+JOB_FAILED = JobState.FAILED.value
+JOB_CANCELLED = JobState.CANCELLED.value
+
+STAGE_WRITE = JobStage.WRITE.value
+STAGE_VERIFY = JobStage.VERIFY.value
+STAGE_EXPAND = JobStage.EXPAND.value
+STAGE_RESIZE = JobStage.RESIZE.value
+
+
 class UsbHint(str, Enum):
     USB2 = "2.0"
     USB3 = "3.0"
@@ -40,6 +67,10 @@ class UsbHint(str, Enum):
 
 class PortCell(BaseModel):
     """One cell in the operator grid."""
+    # Frozen like the cached layout that holds it; extra keys are still
+    # ignored so hand-edited or older layout.json files keep loading
+    model_config = ConfigDict(frozen=True)
+
     cell_id: str                          # e.g. "A1"
     label: str = ""                       # human alias
     port_id: str = ""                     # stable device path / by-path
@@ -48,6 +79,9 @@ class PortCell(BaseModel):
 
 
 class LayoutConfig(BaseModel):
+    # get_layout() hands the same cached instance to every caller
+    model_config = ConfigDict(frozen=True)
+
     schema_version: int = 1
     rows: int = 2
     cols: int = 4
@@ -55,9 +89,37 @@ class LayoutConfig(BaseModel):
     cells: List[PortCell] = Field(default_factory=list)
 
 
+@dataclass(slots=True)
+class LayoutSoA:
+    """
+    A layout's cells as one list per field (struct of arrays): grid-wide
+    filters scan a single list, and the JSON is one array per field.
+    """
+    cell_ids: List[str]
+    labels: List[str]
+    port_ids: List[str]
+    usb_hints: List[str]
+    enabled: List[bool]
+
+    @classmethod
+    def from_layout(cls, layout: LayoutConfig) -> LayoutSoA:
+        cells = layout.cells
+        return cls(
+            cell_ids=[c.cell_id for c in cells],
+            labels=[c.label for c in cells],
+            port_ids=[c.port_id for c in cells],
+            usb_hints=[c.usb_hint.value for c in cells],
+            enabled=[c.enabled for c in cells],
+        )
+
+
 # ── Inventory ────────────────────────────────────────────────────────────────
 
 class DriveInfo(BaseModel):
+    # Shared between callers by the inventory cache — never mutated.
+    # Built only by the scanner, so unknown fields are a bug: forbid them
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     device_path: str                      # /dev/sdX
     by_path: str = ""                     # /dev/disk/by-path/...
     model: str = ""
@@ -74,6 +136,8 @@ class DriveInfo(BaseModel):
 
 
 class ImageInfo(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid", defer_build=True)
+
     name: str
     path: str
     size_bytes: int = 0
@@ -84,6 +148,12 @@ class ImageInfo(BaseModel):
 
 # ── Job / Batch ──────────────────────────────────────────────────────────────
 
+LOG_TAIL_MAX = 500                        # lines kept per job; older ones drop off
+# What a progress callback changes; sent alone as a job_updates patch
+PROGRESS_FIELDS = ("stage", "progress", "speed_bytes", "speed_human", "eta_sec", "eta_human")
+_get_progress = attrgetter(*PROGRESS_FIELDS)
+
+
 class BatchOptions(BaseModel):
     verify: bool = False
     expand_partition: bool = False
@@ -99,6 +169,9 @@ class BatchStartRequest(BaseModel):
 
 
 class JobInfo(BaseModel):
+    """API shape of a job (OpenAPI docs); live state is a JobRecord."""
+    model_config = ConfigDict(extra="forbid", defer_build=True)
+
     job_id: str
     cell_id: str
     device_path: str = ""
@@ -113,14 +186,123 @@ class JobInfo(BaseModel):
     started_at: Optional[float] = None
     finished_at: Optional[float] = None
     error: Optional[str] = None
-    log_tail: List[str] = Field(default_factory=list)
+    log_tail: Deque[str] = Field(default_factory=lambda: deque(maxlen=LOG_TAIL_MAX))
     warning: Optional[str] = None
 
+    @field_serializer("log_tail")
+    def _serialize_log_tail(self, log_tail: Deque[str]) -> List[str]:
+        return list(log_tail)
+
+
+class JobInfoTD(TypedDict, total=False):
+    """JobInfo's wire shape as a plain dict: what JobRecord dumps and SSE/REST send."""
+    job_id: str
+    cell_id: str
+    device_path: str
+    image_name: str
+    state: str
+    stage: str
+    progress: float
+    speed_bytes: float
+    speed_human: str
+    eta_sec: float
+    eta_human: str
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    error: Optional[str]
+    warning: Optional[str]
+    log_tail: List[str]
+
+
+class LogTail(deque):
+    """
+    The last LOG_TAIL_MAX log lines of a job.  append() bumps a counter
+    (from a pipeline thread); the publisher ships the log only in frames
+    where it has moved past the value it last sent.  A counter rather than
+    a flag to clear: an append racing the publisher is never lost.
+    """
+    __slots__ = ("appended", "published")
+
+    def __init__(self, lines=()):
+        super().__init__(lines, maxlen=LOG_TAIL_MAX)
+        self.appended = 0
+        self.published = 0
+
+    def append(self, line: str):
+        super().append(line)
+        self.appended += 1
+
+
+@dataclass(slots=True)
+class JobRecord:
+    """
+    Live state of one job, mutated by the pipeline and its progress
+    callbacks many times a second.  A plain slots dataclass: attribute
+    writes cost nothing extra, and to_dict() builds the JobInfo-shaped
+    payload by hand with no validation.
+    """
+    job_id: str
+    cell_id: str
+    device_path: str = ""
+    image_name: str = ""
+    state: str = JOB_QUEUED               # a JOB_* value
+    stage: str = STAGE_WRITE              # a STAGE_* value
+    progress: float = 0.0                 # 0..1
+    speed_bytes: float = 0.0
+    speed_human: str = ""
+    eta_sec: float = 0.0
+    eta_human: str = ""
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    log_tail: LogTail = field(default_factory=LogTail)
+    warning: Optional[str] = None
+
+    def to_dict(self, with_log: bool = True) -> JobInfoTD:
+        """JSON-ready job, same keys as JobInfo (log_tail only with_log)."""
+        data: JobInfoTD = {
+            "job_id": self.job_id,
+            "cell_id": self.cell_id,
+            "device_path": self.device_path,
+            "image_name": self.image_name,
+            "state": self.state,
+            "stage": self.stage,
+            "progress": self.progress,
+            "speed_bytes": self.speed_bytes,
+            "speed_human": self.speed_human,
+            "eta_sec": self.eta_sec,
+            "eta_human": self.eta_human,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "warning": self.warning,
+        }
+        if with_log:
+            data["log_tail"] = list(self.log_tail)
+        return data
+
+    def progress_dump(self) -> JobInfoTD:
+        """PROGRESS_FIELDS only, JSON-ready."""
+        return dict(zip(PROGRESS_FIELDS, _get_progress(self)))
+
 
 class BatchInfo(BaseModel):
+    model_config = ConfigDict(defer_build=True)
+
     batch_id: str
     image_name: str
     options: BatchOptions = Field(default_factory=BatchOptions)
     concurrency: int = 1
     cell_ids: List[str] = Field(default_factory=list)
     created_at: float = Field(default_factory=time.time)
+
+
+# ── Serialization helpers ────────────────────────────────────────────────────
+# Call the core serializer directly: same result as model_dump(), without
+# BaseModel's Python-side argument handling on every call.
+
+_DRIVEINFO_SER = DriveInfo.__pydantic_serializer__
+
+
+def dump_driveinfo(drive: DriveInfo) -> dict:
+    return _DRIVEINFO_SER.to_python(drive)
@@ -0,0 +1,82 @@
+"""
+Janus — udev hotplug monitor: drops inventory caches and notifies the UI.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+try:
+    import pyudev
+except ImportError:  # in requirements; without it the UI falls back to polling
+    pyudev = None
+
+from core.event_bus import event_bus
+from core.flash_runner import clear_device_size_cache
+from core.inventory_service import invalidate_inventory_cache, invalidate_port_caches
+from core.lsblk_cache import invalidate as invalidate_topology
+
+log = logging.getLogger("janus.udev")
+
+_ACTIONS = {"add", "remove", "change"}
+
+_observer = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _on_uevent(device):
+    """Runs in the observer thread."""
+    action = device.action
+    if action not in _ACTIONS:
+        return
+    invalidate_inventory_cache()
+    invalidate_topology()
+    if device.subsystem == "usb":
+        invalidate_port_caches()
+    if action != "change":
+        clear_device_size_cache()
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_notify, action, device.subsystem, device.sys_name)
+
+
+def _notify(action: str, subsystem: str, name: str):
+    # A single key: a burst of uevents (disk + partitions + usb interfaces)
+    # reaches each client as one drive_change
+    asyncio.ensure_future(event_bus.publish(
+        "drive_change",
+        {"action": action, "subsystem": subsystem, "name": name},
+        key="inventory",
+    ))
+
+
+def start(loop: asyncio.AbstractEventLoop) -> bool:
+    """Start watching block/usb uevents.  False if pyudev is unavailable."""
+    global _observer, _loop
+    if _observer is not None:
+        return True
+    if pyudev is None:
+        log.warning("pyudev not installed: hotplug monitor disabled, drive and port "
+                    "caches only expire by TTL and the UI falls back to polling")
+        return False
+    try:
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by("block")
+        monitor.filter_by("usb")
+        _loop = loop
+        _observer = pyudev.MonitorObserver(monitor, callback=_on_uevent, name="janus-udev")
+        _observer.daemon = True
+        _observer.start()
+    except Exception as exc:
+        log.warning("udev monitor unavailable: %s", exc)
+        _observer = None
+        return False
+    log.info("udev hotplug monitor started")
+    return True
+
+
+def stop():
+    global _observer
+    if _observer is not None:
+        _observer.send_stop()
+        _observer = None
@@ -1,21 +1,24 @@
 """
 Janus — SD Card Mass Flasher.
 """
+import hashlib
+import logging
+import mimetypes
+import os
 from pathlib import Path
 
 import uvicorn
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 
-from api.routes import router
+from api.routes import FastJSONResponse, router
 
-# Check run as root
-import os
-if os.geteuid() != 0:
-    print("WARNING: Janus is not running as root. USB access may be limited, and flashing may fail.")
-else:
-    print("Running as root: full USB access enabled.")
+log = logging.getLogger("janus.main")
+
+# App directory, resolved once: web/, data/ and images/ live next to main.py
+# wherever uvicorn is started from, even through a symlink.
+_BASE_DIR = Path(__file__).resolve().parent
 
 # ---------------------------------------------------------------------------
 # App
@@ -25,31 +28,121 @@ app = FastAPI(
     title="Janus — SD Card Mass Flasher",
     description="Operator-style web UI for mass-flashing SD cards via USB hubs",
     version="1.0.0",
+    default_response_class=FastJSONResponse,
 )
 
-WEB_DIR = Path(__file__).parent / "web"
-app.mount("/static", StaticFiles(directory=WEB_DIR), name="static")
+WEB_DIR = _BASE_DIR / "web"
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """True if the If-None-Match header lists etag exactly, or is "*"."""
+    return any(tag.strip() in (etag, "*") for tag in if_none_match.split(","))
+
+
+def _load_static(root: Path) -> dict[str, tuple[bytes, str, str]]:
+    """Read every file under root: relative path → (body, media type, ETag)."""
+    files = {}
+    for path in root.rglob("*"):
+        if not path.is_file():
+            continue
+        body = path.read_bytes()
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        files[path.relative_to(root).as_posix()] = (body, media_type, _etag(body))
+    return files
+
+
+if os.environ.get("JANUS_STATIC_DEV"):
+    # Edits under web/ show up without a restart
+    app.mount("/static", StaticFiles(directory=WEB_DIR), name="static")
+else:
+    # The asset set is tiny and fixed: keep it in memory, no stat/open per request
+    _STATIC = _load_static(WEB_DIR)
+
+    @app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+    async def static_file(path: str, request: Request):
+        entry = _STATIC.get(path)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        body, media_type, etag = entry
+        if _etag_matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(content=body, media_type=media_type, headers={"ETag": etag})
+
 
 app.include_router(router)
 
 
+# index.html does not change at runtime: read it and build its response
+# once.  The handler stays async — returning a prebuilt object needs no
+# threadpool hop, and reusing it is safe as nothing mutates it on the way out.
+_INDEX_BYTES = (WEB_DIR / "index.html").read_bytes()
+_INDEX_ETAG = _etag(_INDEX_BYTES)
+_INDEX_RESPONSE = HTMLResponse(
+    content=_INDEX_BYTES,
+    headers={"Cache-Control": "public, max-age=60", "ETag": _INDEX_ETAG},
+)
+_INDEX_NOT_MODIFIED = Response(status_code=304, headers={"ETag": _INDEX_ETAG})
+
+
 @app.get("/", response_class=HTMLResponse, include_in_schema=False)
-async def index():
-    return (WEB_DIR / "index.html").read_text(encoding="utf-8")
+async def index(request: Request):
+    if _etag_matches(request.headers.get("if-none-match", ""), _INDEX_ETAG):
+        return _INDEX_NOT_MODIFIED
+    return _INDEX_RESPONSE
 
 
 # ---------------------------------------------------------------------------
 # Startup
 # ---------------------------------------------------------------------------
 
+def _setup_logging():
+    """
+    uvicorn configures only its own loggers: give janus.* its handlers
+    (same format as the server's lines) and INFO level.  Outside uvicorn,
+    or with a custom log config that already covers janus, nothing is
+    taken over.
+    """
+    janus = logging.getLogger("janus")
+    if janus.handlers:
+        return
+    janus.setLevel(logging.INFO)
+    handlers = logging.getLogger("uvicorn").handlers
+    if handlers:
+        for handler in handlers:
+            janus.addHandler(handler)
+        janus.propagate = False
+    elif not logging.getLogger().handlers:
+        logging.basicConfig(format="%(levelname)s: %(name)s: %(message)s")
+
+
 @app.on_event("startup")
 async def on_startup():
+    _setup_logging()
+    # Checked per worker after startup, not at import
+    if os.geteuid() != 0:
+        log.warning("Janus is not running as root. USB access may be limited, and flashing may fail.")
+    else:
+        log.info("Running as root: full USB access enabled.")
     # Ensure data and images directories exist
-    (Path(__file__).parent / "data").mkdir(exist_ok=True)
-    (Path(__file__).parent / "images").mkdir(exist_ok=True)
-    # Initialize layout file if not exists
-    from core.layout_service import get_layout
-    get_layout()
+    for d in ("data", "images"):
+        (_BASE_DIR / d).mkdir(exist_ok=True)
+    # Initialize layout file if not exists; parsing waits for the first request
+    from core.layout_service import ensure_layout_file
+    ensure_layout_file()
+    # Hotplug → drop inventory caches and push drive_change to the UI
+    import asyncio
+    from core import udev_monitor
+    udev_monitor.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    from core import udev_monitor
+    udev_monitor.stop()
 
 
 # ---------------------------------------------------------------------------
@@ -61,6 +154,8 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
         log_level="info",
     )
@@ -0,0 +1,31 @@
+import asyncio
+import os
+
+import pytest
+
+from core.ddrescue_runner import run_ddrescue
+
+
+def test_cancel_kills_ddrescue(tmp_path, monkeypatch):
+    fake = tmp_path / "ddrescue"
+    fake.write_text("#!/bin/sh\nexec sleep 30\n")
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+
+    updates, finished = {}, []
+
+    async def main():
+        task = asyncio.create_task(run_ddrescue(
+            "j1", str(tmp_path / "src"), str(tmp_path / "dst"), None, [],
+            lambda job_id, fields: updates.update(fields),
+            lambda job_id, rc, err: finished.append((rc, err)),
+        ))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    with pytest.raises(ProcessLookupError):
+        os.kill(updates["pid"], 0)
+    assert len(finished) == 1
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import time
+
+from core import flash_runner
+from core.flash_runner import KillSwitch, write_image
+
+# Writes 1000 bytes, then stalls with the pipe open, like a slow xzcat
+_STALLED = [
+    sys.executable, "-c",
+    "import sys, time; sys.stdout.buffer.write(b'x' * 1000); sys.stdout.flush(); time.sleep(30)",
+]
+
+# Fills far more than a pipe's worth of stderr before any output, then fails
+_CHATTY = [
+    sys.executable, "-c",
+    "import sys; sys.stderr.write('w' * 200000 + 'boom'); sys.stderr.flush();"
+    " sys.stdout.buffer.write(b'x' * 1000); sys.exit(3)",
+]
+
+
+class _LateFlag(KillSwitch):
+    """Wakes the reader well before is_set() turns True."""
+
+    def set(self):
+        os.write(self._w, b"x")
+        threading.Timer(0.5, setattr, (self, "_set", True)).start()
+
+
+def _cancel_write(tmp_path, name, kill):
+    image = tmp_path / "test.img.xz"
+    image.write_bytes(b"\0" * 4096)
+    device = tmp_path / name
+    device.touch()
+    log_lines = []
+    result = []
+    worker = threading.Thread(
+        target=lambda: result.append(
+            write_image(str(image), str(device), lambda f: None, log_lines, kill)),
+    )
+    worker.start()
+    time.sleep(0.2)  # let it block in the read
+    kill.set()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+    return result, log_lines
+
+
+def test_cancel_during_stalled_read_is_not_success(tmp_path, monkeypatch):
+    monkeypatch.setattr(flash_runner, "_decompressor_for", lambda path: _STALLED)
+    for i in range(5):
+        result, log_lines = _cancel_write(tmp_path, f"dev{i}", KillSwitch())
+        assert result == [False]
+        assert "CANCELLED: stopping write" in log_lines
+        assert not any(line.endswith("bytes copied") for line in log_lines)
+
+
+def test_short_read_on_cancel_is_not_eof(tmp_path, monkeypatch):
+    # The read returns on the pipe byte alone, whatever the flag says
+    monkeypatch.setattr(flash_runner, "_decompressor_for", lambda path: _STALLED)
+    result, log_lines = _cancel_write(tmp_path, "dev", _LateFlag())
+    assert result == [False]
+    assert not any(line.endswith("bytes copied") for line in log_lines)
+
+
+def test_missing_image_returns_false(tmp_path):
+    log_lines = []
+    assert write_image(str(tmp_path / "missing.img"), str(tmp_path / "dev"),
+                       lambda f: None, log_lines) is False
+    assert log_lines[-1].startswith("ERROR: ")
+
+
+def test_chatty_decompressor_does_not_stall(tmp_path, monkeypatch):
+    monkeypatch.setattr(flash_runner, "_decompressor_for", lambda path: _CHATTY)
+    image = tmp_path / "test.img.xz"
+    image.write_bytes(b"\0" * 4096)
+    device = tmp_path / "dev"
+    device.touch()
+    log_lines = []
+    result = []
+    worker = threading.Thread(
+        target=lambda: result.append(
+            write_image(str(image), str(device), lambda f: None, log_lines)),
+    )
+    worker.start()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+    assert result == [False]
+    assert log_lines[-1].startswith("ERROR: ") and log_lines[-1].endswith("boom")
+    assert len(log_lines[-1]) < 5000
@@ -0,0 +1,43 @@
+import os
+
+from core.inventory_service import _disk_mounts, _mount_table
+
+# btrfs mounts carry an anonymous 0:N device number; only the source
+# (/dev/sdb2) names the partition
+_MOUNTINFO = """\
+28 1 254:0 / / rw,relatime - ext4 /dev/vda rw
+40 28 8:17 / /media/boot rw,relatime - vfat /dev/sdb1 rw
+41 28 0:52 / /media/my\\040stick rw,relatime - btrfs /dev/sdb2 rw,subvol=/
+42 28 0:53 /home /media/home rw,relatime - btrfs /dev/sdb2 rw,subvol=/home
+43 28 0:54 / /media/other rw,relatime - btrfs /dev/sdc1 rw
+"""
+
+
+def _fake_disk(root, name, devno, parts):
+    disk = root / name
+    disk.mkdir()
+    (disk / "dev").write_text(devno + "\n")
+    for part, part_devno in parts.items():
+        (disk / part).mkdir()
+        (disk / part / "partition").write_text("1\n")
+        (disk / part / "dev").write_text(part_devno + "\n")
+    (disk / "queue").mkdir()  # not a partition
+    return os.open(disk, os.O_RDONLY | os.O_DIRECTORY)
+
+
+def test_disk_mounts_by_devno_and_source(tmp_path):
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(_MOUNTINFO)
+    table = _mount_table(str(mountinfo))
+
+    fd = _fake_disk(tmp_path, "sdb", "8:16", {"sdb1": "8:17", "sdb2": "8:18"})
+    try:
+        assert sorted(_disk_mounts(fd, "sdb", table)) == ["/media/boot", "/media/home", "/media/my stick"]
+    finally:
+        os.close(fd)
+
+    fd = _fake_disk(tmp_path, "sdd", "8:48", {"sdd1": "8:49"})
+    try:
+        assert _disk_mounts(fd, "sdd", table) == []
+    finally:
+        os.close(fd)
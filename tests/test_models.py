@@ -0,0 +1,15 @@
+from core.models import LOG_TAIL_MAX, JobRecord
+
+
+def test_log_tail_bounded():
+    job = JobRecord(job_id="j", cell_id="A1")
+    for i in range(LOG_TAIL_MAX + 10):
+        job.log_tail.append(str(i))
+    assert len(job.log_tail) == LOG_TAIL_MAX
+    assert job.log_tail.appended == LOG_TAIL_MAX + 10
+
+
+def test_progress_dump_matches_to_dict():
+    job = JobRecord(job_id="j", cell_id="A1", progress=0.5, speed_human="1 MB/s")
+    full = job.to_dict()
+    assert job.progress_dump() == {k: full[k] for k in job.progress_dump()}
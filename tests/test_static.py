@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+
+def test_static_head():
+    r = client.head("/static/app.js")
+    assert r.status_code == 200
+    assert r.headers["etag"]
+
+
+def test_static_if_none_match():
+    etag = client.get("/static/app.js").headers["etag"]
+    for header in (etag, f'"other", {etag}', "*"):
+        assert client.get("/static/app.js", headers={"If-None-Match": header}).status_code == 304
+    for header in (f"W/{etag}", f"x{etag}x", '"other"'):
+        assert client.get("/static/app.js", headers={"If-None-Match": header}).status_code == 200
+
+
+def test_index_if_none_match():
+    etag = client.get("/").headers["etag"]
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/", headers={"If-None-Match": f"W/{etag}"}).status_code == 200
+
+
+def test_index_serves_cached_file():
+    r = client.get("/")
+    assert r.status_code == 200
+    assert r.content == (main.WEB_DIR / "index.html").read_bytes()
+    assert r.headers["cache-control"] == "public, max-age=60"
+    assert r.headers["content-type"].startswith("text/html")
@@ -145,15 +145,33 @@ function connectSSE() {
         S.sseConnected = true;
         console.log('SSE connected');
     };
-    sseSource.addEventListener('job_update', (e) => {
+    // One frame per ~50 ms: full jobs, or {job_id, patch} for progress ticks
+    sseSource.addEventListener('job_updates', (e) => {
         try {
-            const job = JSON.parse(e.data);
-            S.jobs[job.job_id] = job;
-            S.jobByCellId[job.cell_id] = job;
-            updateCell(job.cell_id);
+            const { updates } = JSON.parse(e.data);
+            for (const u of updates) {
+                if (u.patch) {
+                    const job = S.jobs[u.job_id];
+                    if (!job) continue;  // the next full update brings the job
+                    Object.assign(job, u.patch);
+                    updateCell(job.cell_id);
+                } else {
+                    const prev = S.jobs[u.job_id];
+                    // log_tail is sent only when lines were added
+                    if (!u.log_tail && prev) u.log_tail = prev.log_tail;
+                    S.jobs[u.job_id] = u;
+                    S.jobByCellId[u.cell_id] = u;
+                    updateCell(u.cell_id);
+                }
+            }
             updateCounters();
         } catch (err) { console.warn('SSE parse error', err); }
     });
+    // Hotplug (server side pyudev): refresh right away instead of waiting for the poll
+    sseSource.addEventListener('drive_change', () => {
+        loadDrives();
+        loadPhysicalPorts();
+    });
     sseSource.onerror = () => {
         S.sseConnected = false;
         sseSource.close();